@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+# DMX packets per second over loopback to a dmxnet.Receiver, for
+# Art-Net and sACN.  Every frame all universes get new values and are
+# sent, either set channel by channel or copied in as arrays, and sent
+# with one sendto() per universe or, copied in, with one sendmmsg().
+#
+#   python benchmarks/bench_dmx.py [universes] [frames]
+
+import os
+import sys
+import time
+import select
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chromesthesia_app"))
+import dmxnet
+
+class Drain(threading.Thread):
+    def __init__(self, receiver):
+        super(Drain, self).__init__()
+        self.daemon = True
+        self._receiver = receiver
+        self._running = True
+
+    def run(self):
+        while self._running:
+            select.select([self._receiver], [], [], 0.05)
+            self._receiver.receive()
+
+    def stop(self):
+        self._running = False
+        self.join()
+        self._receiver.receive()
+
+# Per channel, as with a set() call for every channel of every fixture
+def per_channel(packets, frame):
+    values = frame.tolist()
+    for packet in packets:
+        buf = packet.buf
+        offset = packet.header
+        for channel in range(0, dmxnet.CHANNELS):
+            buf[offset + channel] = values[channel]
+
+def per_universe(packets, frame):
+    for packet in packets:
+        packet.data[:] = frame
+
+def bench(protocol, universes, frames, fill, batch):
+    receiver = dmxnet.Receiver(protocol)
+    drain = Drain(receiver)
+    drain.start()
+    transport = dmxnet.Transport(protocol, "127.0.0.1", receiver.address[1],
+        batch=batch)
+    packets = [transport.packet(u) for u in range(0, universes)]
+    values = np.random.randint(0, 256, (16, dmxnet.CHANNELS)).astype(np.uint8)
+
+    start = time.perf_counter()
+    for i in range(0, frames):
+        fill(packets, values[i % len(values)])
+        transport.send(packets)
+    elapsed = time.perf_counter() - start
+
+    time.sleep(0.1)
+    drain.stop()
+    receiver.close()
+    transport.close()
+    return (transport.packets / elapsed, receiver.packets, transport.packets)
+
+if __name__ == "__main__":
+    universes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for protocol in ["artnet", "sacn"]:
+        for (name, fill, batch) in [
+                ("per channel, sendto ", per_channel, False),
+                ("per universe, sendto", per_universe, False),
+                ("per universe, batch ", per_universe, True)]:
+            (rate, received, sent) = bench(protocol, universes, frames,
+                fill, batch)
+            print("{0:6s} {1:3d} universes, {2}: {3:9.0f} packets/s "
+                "({4}/{5} received)".format(protocol, universes, name, rate,
+                received, sent))
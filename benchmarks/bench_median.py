@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+# Per-frame cost of the sliding median used as onset threshold, with
+# the window of fps * 5 frames at 60 and 240 fps.  Sorting the window
+# every frame is compared with filter.MMF for a single band and
+# np.median over the window with filter.MultiMMF for a bank of bands.
+#
+#   python benchmarks/bench_median.py [frames]
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chromesthesia_app"))
+import filter
+
+# Naive median, sort the whole window for every new value
+class SortMedian(object):
+    def __init__(self, size):
+        self._size = size
+        self._a = []
+
+    def add(self, value):
+        self._a.append(value)
+        if len(self._a) > self._size:
+            self._a.pop(0)
+        a = sorted(self._a)
+        n = len(a)
+        return (a[(n - 1) // 2] + a[n // 2]) / 2.0
+
+# Naive median over a bank of bands
+class SortMultiMedian(object):
+    def __init__(self, size, channels):
+        self._a = np.zeros((size, channels))
+        self._size = size
+        self._n = 0
+
+    def add(self, values):
+        self._a[self._n % self._size] = values
+        self._n += 1
+        return np.median(self._a[:min(self._n, self._size)], axis=0)
+
+def timeit(add, values, frames):
+    start = time.perf_counter()
+    for i in range(0, frames):
+        add(values[i % len(values)])
+    return (time.perf_counter() - start) / frames
+
+def bench(fps, channels, frames):
+    size = fps * 5
+    values = np.abs(np.random.randn(4096, channels))
+
+    # Warm up to a full window, results must match
+    naive = SortMedian(size)
+    mmf = filter.MMF(size)
+    multi_naive = SortMultiMedian(size, channels)
+    multi = filter.MultiMMF(size, channels)
+    for i in range(0, size + 10):
+        value = float(values[i, 0])
+        expected = naive.add(value)
+        mmf.add(value)
+        assert abs(mmf.value() - expected) < 1e-12
+        expected = multi_naive.add(values[i])
+        multi.add(values[i])
+        np.testing.assert_allclose(multi.value, expected)
+
+    scalars = values[:, 0].tolist()
+    before = timeit(naive.add, scalars, frames)
+    after = timeit(mmf.add, scalars, frames)
+    print("window {0:5d}, 1 band:   sort {1:8.1f} us  MMF {2:8.1f} us  {3:5.1f}x"\
+        .format(size, before * 1e6, after * 1e6, before / after))
+
+    before = timeit(multi_naive.add, values, frames)
+    after = timeit(multi.add, values, frames)
+    print("window {0:5d}, {1} bands: sort {2:8.1f} us  MMF {3:8.1f} us  {4:5.1f}x"\
+        .format(size, channels, before * 1e6, after * 1e6, before / after))
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for fps in [60, 240]:
+        bench(fps, 32, frames)
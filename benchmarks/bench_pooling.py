@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+# Per-frame cost of pooling the power spectrum into bands, the
+# per-bin Python loop versus the vectorized spectrum.BandPool.
+#
+#   python benchmarks/bench_pooling.py [frames]
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "chromesthesia_app"))
+import spectrum
+
+def loop_pool(bins, power, eq, scale):
+    out = [0] * len(bins)
+    i = 0
+    for bin in bins:
+        s,e = bin
+        out[i] = np.mean(power[s:e]) if e > s else 0.0
+        i = i + 1
+    out = np.multiply(out, eq)
+    out = np.divide(out, scale)
+    return out.clip(0.0, 1.0)
+
+def linear_bins(size, bands):
+    edges = np.linspace(0, size, bands + 1).astype(int)
+    return [[int(edges[i]), int(edges[i+1])] for i in range(0, bands)]
+
+def bench(name, bins, size, frames):
+    eq = np.power(2, np.linspace(0, 6, len(bins)))
+    pool = spectrum.BandPool(bins, size, eq)
+    powers = np.abs(np.random.randn(64, size)) * 100
+
+    np.testing.assert_allclose(loop_pool(bins, powers[0], eq, 3.0),
+        pool.pool(powers[0], 3.0))
+
+    start = time.perf_counter()
+    for i in range(0, frames):
+        loop_pool(bins, powers[i % 64], eq, 3.0)
+    before = (time.perf_counter() - start) / frames
+
+    start = time.perf_counter()
+    for i in range(0, frames):
+        pool.pool(powers[i % 64], 3.0)
+    after = (time.perf_counter() - start) / frames
+
+    print("{:<28s} {:4d} bands  loop {:8.2f} us/frame  "
+          "pool {:8.2f} us/frame  {:5.1f}x".format(name, len(bins),
+          before * 1e6, after * 1e6, before / after))
+
+if __name__ == '__main__':
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for (sample, fps) in [(44100, 60), (44100, 120), (48000, 240)]:
+        chunk = int(sample / fps)
+        size = chunk // 2 + 1
+        bench("{:d} Hz {:d} fps".format(sample, fps),
+            spectrum.band_layout(sample, chunk), size, frames)
+    for bands in [32, 128]:
+        bench("44100 Hz 60 fps linear", linear_bins(368, bands), 368, frames)
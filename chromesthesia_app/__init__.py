@@ -24,6 +24,26 @@ parser = argparse.ArgumentParser()
 parser.add_argument("-v", action="append_const",
                     dest="verbose", const=True, default=[],
                     help="Verbose, specify twice for more verbosity")
+parser.add_argument("-a", "--analyze", metavar="FILE",
+                    help="Analyze a WAV or raw PCM file offline and exit")
+parser.add_argument("-o", "--features", metavar="FILE",
+                    help="Feature file to write offline analysis to")
+parser.add_argument("--fps", type=int, default=60,
+                    help="Analysis frame rate for offline analysis")
+parser.add_argument("--freq", type=int, default=44100,
+                    help="Sample rate of raw PCM files")
+parser.add_argument("--format", default="int16",
+                    choices=["int16", "int24", "float32"],
+                    help="Sample format of raw PCM files")
+parser.add_argument("--channels", type=int, default=1,
+                    help="Number of channels in raw PCM files")
+parser.add_argument("--fftsize", type=int, default=0,
+                    help="STFT window size in samples, 0 for one frame")
+parser.add_argument("--window", default="rect",
+                    choices=["rect", "hann", "hamming", "blackman"],
+                    help="STFT window function")
+parser.add_argument("--bands", type=int, default=3,
+                    help="Number of analysis bands")
 config = parser.parse_args()
 config.verbose = len(config.verbose)
 config.verbose = config.verbose if config.verbose <=2 else 2
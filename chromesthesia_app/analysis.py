@@ -0,0 +1,104 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import numpy as np
+
+# Analysis frame layout version, bump on incompatible changes
+VERSION = 1
+
+# Default band names
+BANDS = ("bass", "mid", "tre")
+
+# Fixed layout of one analysis frame.  This is the format frames are
+# passed in between the analyzer and the outputs.
+def dtype(nbands, nspectrum):
+    return np.dtype([
+        ("timestamp", np.float64),
+        ("silence", np.bool_),
+        ("level", np.float64, (nbands,)),
+        ("flux", np.float64, (nbands,)),
+        ("transient", np.float64, (nbands,)),
+        ("spectrum", np.float64, (nspectrum,)),
+    ])
+
+class Band(object):
+    __slots__ = ("name", "level", "flux", "transient")
+
+    def __init__(self, name):
+        self.name = name
+        self.level = 0.0
+        self.flux = 0.0
+        self.transient = 0.0
+
+    # Compatibility with the old dict based frame
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+# Named bands of a frame, band objects are also set as attributes
+class Bins(object):
+    def __init__(self, names):
+        self._bands = [Band(name) for name in names]
+        for band in self._bands:
+            setattr(self, band.name, band)
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._bands)
+
+    def __len__(self):
+        return len(self._bands)
+
+    def keys(self):
+        return [band.name for band in self._bands]
+
+# Analysis frame as seen by the outputs.  A frame is allocated once
+# and reloaded in place for every new record, bands are available as
+# attributes (frame.bins.bass.level) and as numpy arrays over all
+# bands (frame.level).  frame["bins"]["bass"]["level"] is supported
+# for outputs written against the old dict based frames.
+class Frame(object):
+    __slots__ = ("version", "record", "bins", "seq", "timestamp",
+                 "silence", "level", "flux", "transient", "spectrum")
+
+    def __init__(self, nspectrum, names=BANDS):
+        self.version = VERSION
+        self.record = np.zeros((), dtype=dtype(len(names), nspectrum))
+        self.bins = Bins(names)
+        self.seq = 0
+        self.timestamp = 0.0
+        self.silence = True
+        self.level = self.record["level"]
+        self.flux = self.record["flux"]
+        self.transient = self.record["transient"]
+        self.spectrum = self.record["spectrum"]
+
+    # Refresh the scalar attributes after self.record has been updated
+    def load(self, seq=0):
+        record = self.record
+        self.seq = seq
+        self.timestamp = float(record["timestamp"])
+        self.silence = bool(record["silence"])
+        for (band, level, flux, transient) in zip(self.bins,
+                self.level.tolist(), self.flux.tolist(),
+                self.transient.tolist()):
+            band.level = level
+            band.flux = flux
+            band.transient = transient
+        return self
+
+    def __getitem__(self, key):
+        return getattr(self, key)
@@ -0,0 +1,116 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import numpy as np
+
+import filter
+
+# Level, spectral flux and onset/transient tracking for a bank of
+# bands.  All state lives in arrays with one entry per band and is
+# updated in a single pass per frame.
+class BandBank(object):
+    def __init__(self, fps, bands):
+        self._fps = fps
+        self.bands = bands
+
+        # Approximated rolling average of the input levels
+        self._level = filter.MultiEMA(0.5, bands)
+        self.level = self._level.value
+        self._prevlevel = np.zeros(bands)
+        self._flux = np.zeros(bands)
+        self._avgflux = filter.MultiRMA(fps * 2.5, bands)
+        self._avgflux_rect = filter.MultiRMA(fps * 2.5, bands)
+        self._flux_thres = filter.MultiMMF(fps * 5, bands)
+
+        self._attack = np.zeros(bands, dtype=np.bool_)
+        self._in_transient = np.zeros(bands, dtype=np.bool_)
+        self._transient = np.zeros(bands)
+        self._onset_ts = np.zeros(bands)
+        self._attack_sum = np.zeros(bands)
+        self._attack_count = np.zeros(bands)
+        self._transient_level = np.zeros(bands)
+        self._transient_period = filter.MultiRMA(fps * 2, bands)
+        self._transient_period.add(np.full(bands, 0.25))
+
+        self.flux = self._avgflux.value
+        self.transient = np.zeros(bands)
+
+    # Add new band levels sampled at time now, dt seconds after
+    # the previous levels
+    def update(self, values, now, dt):
+        level = self.level
+        prev = self._prevlevel
+        flux = self._flux
+
+        np.copyto(prev, level)
+        self._level.add(values)
+
+        # Update spectral flux value
+        np.subtract(level, prev, out=flux)
+        self._avgflux.add(np.abs(flux))
+
+        # Onset/transient calculation
+        in_attack = level >= prev
+        onset = flux - self._avgflux_rect.value >= self._flux_thres.value
+
+        attack = self._attack
+        in_transient = self._in_transient
+        transient = self._transient
+        period = self._transient_period
+
+        active = in_transient.copy()
+        start = onset & ~active
+        if start.any():
+            attack[start] = True
+            in_transient[start] = True
+            transient[start] = 1.0
+            self._onset_ts[start] = now
+            self._attack_sum[start] = level[start]
+            self._attack_count[start] = 1
+            self._transient_level[start] = level[start]
+
+        if active.any():
+            transient[active] -= 1.0 / (period.value[active] / dt)
+
+            attacking = active & attack
+            decaying = active & ~attack
+
+            peaked = attacking & ~in_attack
+            self._transient_level[peaked] = 0.75 * \
+                self._attack_sum[peaked] / self._attack_count[peaked]
+            rising = attacking & in_attack
+            self._attack_sum[rising] += level[rising]
+            self._attack_count[rising] += 1
+            attack[attacking] = in_attack[attacking]
+
+            below = decaying & (level < self._transient_level)
+            ended = below & (transient <= 0.0)
+            transient[ended] = 0.0
+            in_transient[ended] = False
+            transient[below] /= 2
+
+            timeout = decaying & (transient <= -4.0)
+            transient[timeout] = 0.0
+            in_transient[timeout] = False
+
+            if ended.any() or timeout.any():
+                length = np.minimum(1.0, now - self._onset_ts)
+                period.add(np.where(ended, length, period.value),
+                    ended | timeout)
+
+        self._avgflux_rect.add(np.maximum(0.0, flux))
+        self._flux_thres.add(flux, flux > 0)
+
+        np.maximum(transient, 0.0, out=self.transient)
@@ -15,9 +15,11 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
 
 import sys
+import os
 import output
 import console
 import log
+import spectrum
 from threading import Event
 from multiprocessing import Pipe
 from select import select
@@ -79,10 +81,14 @@ class SoundProxy(object):
             return
         self.sa.stop()
         self.outputs.stop()
-        try:
-            self.sa.data()
-        except:
-            pass
+        self.sa.data()
+        log.Logger().debug("Sound processing stopped, {0} frames dropped, "\
+            "{1} overflows, {2} underflows, {3} source errors, "\
+            "backlog {4}".format(self.sa.dropped, self.sa.overflows,
+            self.sa.underflows, self.sa.errors, self.sa.backlog))
+        if self.sa.start_latency != None:
+            log.Logger().debug("First frame {0:.1f} ms after start".format(
+                self.sa.start_latency * 1000))
         self.running = False
 
     def close(self):
@@ -96,8 +102,10 @@ class SoundProxy(object):
         return self.sa.fileno()
 
     def read(self):
+        data = self.sa.data()
+        if data is None:
+            return
         try:
-            data = self.sa.data()
             self.outputs.update(data)
         except:
             pass
@@ -157,18 +165,62 @@ class CmdHelp(Command):
             "Begin with any of the following commands " + ", ".join(cmds)
         ]
 
+def analyze(config):
+    import offline
+
+    features = config.features
+    if features == None:
+        features = os.path.splitext(config.analyze)[0] + ".npz"
+
+    try:
+        stats = offline.analyze(config.analyze, features, config.fps,
+            config.freq, config.format, config.channels,
+            config.fftsize, config.window, config.bands)
+    except (IOError, ValueError) as e:
+        print("Failed to analyze {0}: {1}".format(config.analyze, str(e)))
+        return 1
+
+    print("Analyzed {0:.1f}s of audio in {1:.2f}s ({2:.1f}x realtime)".format(
+        stats["duration"], stats["elapsed"], stats["realtime"]))
+    print("{0} frames, {1:.0f} frames/s, {2:.1f} us/frame".format(
+        stats["frames"], stats["fps"], stats["frame_time"] * 1e6))
+    print("Features written to {0}".format(features))
+    return 0
+
 def main(config):
     print("This is chromesthesia {0}".format(__version__))
 
+    if config.analyze:
+        return analyze(config)
+
     logger = log.Logger()
     sp = SoundProxy(None)
 
     settings = Settings()
 
+    # The analyzer is created once, later changes are applied in place
     def reinit_sa(key, value):
-        sp.sa = SoundAnalyzer(settings["freq"], settings["fps"])
-    settings.create("fps", 60, reinit_sa)
-    settings.create("freq", 44100, reinit_sa)
+        # Output calls longer than one frame are reported as missed
+        sp.outputs.deadline = 1.0 / settings["fps"]
+        if sp.sa == None:
+            sp.sa = SoundAnalyzer(settings["freq"], settings["fps"],
+                settings["format"], settings["channels"], settings["source"],
+                settings["fftsize"], settings["window"], settings["bands"])
+            return
+        sp.sa.configure(sample=settings["freq"], fps=settings["fps"],
+            format=settings["format"], channels=settings["channels"],
+            source=settings["source"], fftsize=settings["fftsize"],
+            window=settings["window"], bands=settings["bands"])
+    settings.create("fps", 60, reinit_sa, min=1, max=1000)
+    settings.create("freq", 44100, reinit_sa, min=1000, max=384000)
+    settings.create("format", "int16", reinit_sa,
+        values=SoundAnalyzer.formats)
+    settings.create("channels", 1, reinit_sa, min=1, max=64)
+    settings.create("source", "pyaudio", reinit_sa)
+    settings.create("fftsize", 0, reinit_sa, min=0, max=65536)
+    settings.create("window", "rect", reinit_sa,
+        values=sorted(spectrum.STFT.windows.keys()))
+    settings.create("bands", 3, reinit_sa, min=3, max=1024)
     reinit_sa(None, None)
 
     def debug(key, value):
@@ -177,7 +229,7 @@ def main(config):
             logger.add_level(log.DEBUG)
         if value >= 2:
             logger.add_level(log.DEBUG2)
-    settings.create("debug", config.verbose, debug)
+    settings.create("debug", config.verbose, debug, min=0, max=2)
 
     running = Event()
 
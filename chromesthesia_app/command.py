@@ -76,6 +76,8 @@ class Command(object):
             objtype = None
             if ident == tokenize.ENDMARKER:
                 break
+            elif ident in (tokenize.NEWLINE, tokenize.NL):
+                continue
             elif ident == tokenize.NAME:
                 objtype = type(value)
             elif ident == tokenize.STRING:
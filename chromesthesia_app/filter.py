@@ -13,7 +13,12 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
 
-# Rolling moving average
+import math
+import heapq
+import numpy as np
+
+# Rolling moving average.  The running sum is recomputed from the
+# window once per window length so rounding errors can't accumulate.
 class RMA(object):
     def __init__(self, size):
         self._size = int(size)
@@ -27,30 +32,293 @@ class RMA(object):
         self._sum = self._sum - self._a[self._index]
         self._a[self._index] = value
         self._sum = self._sum + value
+        self._index = (self._index + 1) % self._size
+        if self._index == 0:
+            self._sum = math.fsum(self._a)
         self._fill = min(self._size, self._fill + 1)
         self._average = float(self._sum / self._fill)
-        self._index = (self._index + 1) % self._size
 
     def value(self):
         return self._average
 
-# Moving median filter
+# Moving median filter over the last size values.
+#
+# The window is split over two heaps, a max-heap holding the lower
+# half and a min-heap holding the upper half, so the median is always
+# at the top of the heaps.  Entries are keyed on (value, sequence) to
+# give every entry a unique position.  Values leaving the window are
+# deleted lazily, only counted out of their heap and dropped once they
+# surface at the top, and the heaps are compacted when the stale
+# entries outnumber the live ones.  add() is O(log n) amortized.
+# Until the window has filled up the median is over the values seen.
 class MMF(object):
     def __init__(self, size):
-        size = int(size)
-        self._size = size
-        self._a = [0] * size
+        self._size = max(1, int(size))
+        self._a = [0] * self._size
+        self._seq = 0
+        self._low = []
+        self._high = []
+        self._nlow = 0
+        self._nhigh = 0
         self._median = 0.0
-        self._pos = 0
-        if self._size % 2:
-            self._index = [int((size / 2) - 1), int(size / 2)]
-        else:
-            self._index = [int(size / 2), int(size / 2)]
+
+    # Drop expired entries from the top of both heaps
+    def _prune(self):
+        oldest = self._seq - self._size
+        low = self._low
+        high = self._high
+        while low and -low[0][1] < oldest:
+            heapq.heappop(low)
+        while high and high[0][1] < oldest:
+            heapq.heappop(high)
+
+    def _balance(self):
+        while self._nlow > self._nhigh + 1:
+            (value, seq) = heapq.heappop(self._low)
+            heapq.heappush(self._high, (-value, -seq))
+            self._nlow -= 1
+            self._nhigh += 1
+            self._prune()
+        while self._nlow < self._nhigh:
+            (value, seq) = heapq.heappop(self._high)
+            heapq.heappush(self._low, (-value, -seq))
+            self._nhigh -= 1
+            self._nlow += 1
+            self._prune()
+
+    def _compact(self):
+        oldest = self._seq - self._size
+        self._low = [e for e in self._low if -e[1] >= oldest]
+        self._high = [e for e in self._high if e[1] >= oldest]
+        heapq.heapify(self._low)
+        heapq.heapify(self._high)
 
     def add(self, value):
-        self._a[self._pos] = value
-        self._pos = (self._pos + 1) % self._size
-        self._median = (self._a[self._index[0]] + self._a[self._index[1]]) / 2.0
+        seq = self._seq
+        index = seq % self._size
+
+        # Count the value leaving the window out of its heap
+        if seq >= self._size:
+            old = (self._a[index], seq - self._size)
+            top = self._low[0]
+            if old <= (-top[0], -top[1]):
+                self._nlow -= 1
+            else:
+                self._nhigh -= 1
+
+        self._a[index] = value
+        self._seq = seq + 1
+        self._prune()
+
+        if self._nlow > 0 and (value, seq) <= \
+                (-self._low[0][0], -self._low[0][1]):
+            heapq.heappush(self._low, (-value, -seq))
+            self._nlow += 1
+        else:
+            heapq.heappush(self._high, (value, seq))
+            self._nhigh += 1
+        self._balance()
+
+        if len(self._low) + len(self._high) > 2 * self._size + 16:
+            self._compact()
+
+        if (self._nlow + self._nhigh) % 2:
+            self._median = float(-self._low[0][0])
+        else:
+            self._median = (-self._low[0][0] + self._high[0][0]) / 2.0
 
     def value(self):
         return self._median
+
+# The filters below work on many channels at once.  They take and
+# return arrays with one entry per channel, the current output of
+# every channel is kept in the value array which is updated in place.
+# add() takes one frame and an optional mask selecting the channels
+# to update, add_many() takes several frames, one row per frame, and
+# leaves the filter as if the rows had been added one at a time.
+
+# Moving median filter over many channels, see MMF.  Each channel
+# runs its own heaps, which keeps the update O(log n) per channel.
+# Keeping sorted windows in one array and updating every channel with
+# vectorized operations was measured as well, but every update touches
+# the whole window and that is slower than the heaps for any window of
+# a few seconds.
+class MultiMMF(object):
+    def __init__(self, size, channels):
+        self._filters = [MMF(size) for i in range(0, channels)]
+        self._all = range(0, channels)
+        self.value = np.zeros(channels)
+
+    def add(self, values, mask=None):
+        cols = self._all if mask is None else np.flatnonzero(mask).tolist()
+        values = np.asarray(values, dtype=np.float64).tolist()
+        filters = self._filters
+        value = self.value
+        for i in cols:
+            f = filters[i]
+            f.add(values[i])
+            value[i] = f.value()
+        return value
+
+    # Add several frames of values at once, one row per frame
+    def add_many(self, values):
+        for row in np.asarray(values, dtype=np.float64):
+            self.add(row)
+        return self.value
+
+# Rolling moving average over many channels.  The running sums are
+# recomputed from the window once per window length so rounding
+# errors can't accumulate over a long show.
+class MultiRMA(object):
+    def __init__(self, size, channels):
+        self._size = max(1, int(size))
+        self._a = np.zeros((self._size, channels))
+        self._index = np.zeros(channels, dtype=np.intp)
+        self._fill = np.zeros(channels)
+        self._sum = np.zeros(channels)
+        self._count = 0
+        self._all = np.arange(channels)
+        self.value = np.zeros(channels)
+
+    def _resum(self):
+        self._count = 0
+        np.sum(self._a, axis=0, out=self._sum)
+
+    def add(self, values, mask=None):
+        cols = self._all if mask is None else np.flatnonzero(mask)
+        if len(cols) == 0:
+            return self.value
+        values = np.asarray(values, dtype=np.float64)[cols]
+        index = self._index[cols]
+        self._sum[cols] += values - self._a[index, cols]
+        self._a[index, cols] = values
+        self._index[cols] = (index + 1) % self._size
+        self._fill[cols] = np.minimum(self._size, self._fill[cols] + 1)
+
+        self._count += 1
+        if self._count >= self._size:
+            self._resum()
+        self.value[cols] = self._sum[cols] / self._fill[cols]
+        return self.value
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return self.value
+        # Only the last window of rows ends up in the ring
+        skip = max(0, n - self._size)
+        rows = np.arange(skip, n)[:, np.newaxis]
+        self._a[(self._index + rows) % self._size, self._all] = values[skip:]
+        self._index = (self._index + n) % self._size
+        self._fill = np.minimum(self._size, self._fill + n)
+        self._resum()
+        np.divide(self._sum, self._fill, out=self.value)
+        return self.value
+
+# Exponential moving average over many channels,
+# value += alpha * (x - value)
+class MultiEMA(object):
+    def __init__(self, alpha, channels):
+        self._alpha = float(alpha)
+        self._all = np.arange(channels)
+        self.value = np.zeros(channels)
+
+    def add(self, values, mask=None):
+        values = np.asarray(values, dtype=np.float64)
+        if mask is None:
+            self.value += self._alpha * (values - self.value)
+        else:
+            cols = np.flatnonzero(mask)
+            self.value[cols] += self._alpha * (values[cols] - self.value[cols])
+        return self.value
+
+    # The rows are folded in with their decayed weights in one step
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return self.value
+        keep = 1.0 - self._alpha
+        weights = self._alpha * np.power(keep, np.arange(n - 1, -1, -1))
+        self.value *= keep ** n
+        self.value += np.dot(weights, values)
+        return self.value
+
+# Attack/release envelope follower over many channels.  The output
+# moves towards rising input with the attack coefficient and towards
+# falling input with the release coefficient, both per frame in the
+# range (0.0, 1.0], 1.0 follows the input directly.
+class MultiEnvelope(object):
+    def __init__(self, attack, release, channels):
+        self._attack = float(attack)
+        self._release = float(release)
+        self._all = np.arange(channels)
+        self.value = np.zeros(channels)
+
+    def add(self, values, mask=None):
+        values = np.asarray(values, dtype=np.float64)
+        cols = self._all if mask is None else np.flatnonzero(mask)
+        value = self.value[cols]
+        diff = values[cols] - value
+        value += np.where(diff > 0, self._attack, self._release) * diff
+        self.value[cols] = value
+        return self.value
+
+    # The envelope depends on every intermediate value, the rows
+    # are applied in order but each row is vectorized over channels
+    def add_many(self, values):
+        for row in np.asarray(values, dtype=np.float64):
+            self.add(row)
+        return self.value
+
+# Rolling maximum over many channels.  The maximum is kept up to date
+# incrementally and the window of a channel is only rescanned when its
+# maximum leaves the window.  The value is -inf until the first add.
+class MultiMax(object):
+    _empty = -np.inf
+    _better = np.maximum
+
+    def __init__(self, size, channels):
+        self._size = max(1, int(size))
+        self._a = np.full((self._size, channels), self._empty)
+        self._index = np.zeros(channels, dtype=np.intp)
+        self._all = np.arange(channels)
+        self.value = np.full(channels, self._empty)
+
+    def add(self, values, mask=None):
+        cols = self._all if mask is None else np.flatnonzero(mask)
+        if len(cols) == 0:
+            return self.value
+        values = np.asarray(values, dtype=np.float64)[cols]
+        index = self._index[cols]
+        old = self._a[index, cols]
+        self._a[index, cols] = values
+        self._index[cols] = (index + 1) % self._size
+
+        current = self.value[cols]
+        value = self._better(current, values)
+        # The old extreme left the window without being replaced
+        stale = (old == current) & (self._better(values, old) != values)
+        if stale.any():
+            value[stale] = self._better.reduce(self._a[:, cols[stale]], axis=0)
+        self.value[cols] = value
+        return self.value
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n == 0:
+            return self.value
+        skip = max(0, n - self._size)
+        rows = np.arange(skip, n)[:, np.newaxis]
+        self._a[(self._index + rows) % self._size, self._all] = values[skip:]
+        self._index = (self._index + n) % self._size
+        self._better.reduce(self._a, axis=0, out=self.value)
+        return self.value
+
+# Rolling minimum over many channels, see MultiMax.  The value is
+# +inf until the first add.
+class MultiMin(MultiMax):
+    _empty = np.inf
+    _better = np.minimum
@@ -0,0 +1,166 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+# Offline analysis of audio files.  Runs the same pipeline as live
+# capture over a WAV or raw PCM file as fast as possible and writes
+# the analysis frames to a feature file (numpy .npz) holding the
+# frame records and the parameters used to produce them.
+
+import os
+import time
+import wave
+import struct
+import numpy as np
+
+import pcm
+import analysis
+from sound import Pipeline
+
+# Sample width of PCM WAV files to capture format
+_wav_formats = {
+    2 : "int16",
+    3 : "int24",
+}
+
+# Names of WAV format tags wave can't read
+_wav_tags = {
+    0x0003 : "IEEE float",
+    0x0006 : "A-law",
+    0x0007 : "mu-law",
+    0xfffe : "WAVE_FORMAT_EXTENSIBLE",
+}
+
+# Returns the format tag of a RIFF/WAVE file, 0 if the file has the
+# RIFF/WAVE magic but no format chunk, or None if it isn't a WAV file
+def _wav_tag(path):
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[0:4] != b"RIFF" or \
+                header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return 0
+            (name, size) = struct.unpack("<4sI", chunk)
+            if name == b"fmt ":
+                data = f.read(2)
+                return struct.unpack("<H", data)[0] if len(data) == 2 else 0
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+class AudioFile(object):
+    def __init__(self, path, sample=44100, fmt="int16", channels=1):
+        self._wav = None
+        try:
+            wav = wave.open(path, "rb")
+        except (wave.Error, EOFError) as e:
+            # Only files without the WAV magic are read as raw PCM
+            tag = _wav_tag(path)
+            if tag != None:
+                raise ValueError("Unsupported WAV file {0}: {1}".format(path,
+                    _wav_tags.get(tag, str(e))))
+            wav = None
+
+        if wav != None:
+            width = wav.getsampwidth()
+            if width not in _wav_formats:
+                wav.close()
+                raise ValueError(
+                    "Unsupported WAV sample width: {0}".format(width * 8))
+            self._wav = wav
+            self.sample = wav.getframerate()
+            self.format = _wav_formats[width]
+            self.channels = wav.getnchannels()
+            self.frames = wav.getnframes()
+        else:
+            if fmt not in pcm.FORMATS:
+                raise ValueError("Unsupported sample format: {0}".format(fmt))
+            self._file = open(path, "rb")
+            self.sample = sample
+            self.format = fmt
+            self.channels = channels
+            size = pcm.FORMATS[fmt][0] * channels
+            self.frames = os.path.getsize(path) // size
+        self.frame_size = pcm.FORMATS[self.format][0] * self.channels
+
+    def read(self, frames):
+        if self._wav != None:
+            return self._wav.readframes(frames)
+        return self._file.read(frames * self.frame_size)
+
+    def close(self):
+        if self._wav != None:
+            self._wav.close()
+        else:
+            self._file.close()
+
+# Analyze the audio file at path and write the frames to features.
+# Raw PCM files are read with the given sample rate, format and
+# channels, WAV files use the parameters from the file header.
+# Returns a dict with throughput statistics.
+def analyze(path, features, fps=60, sample=44100, fmt="int16", channels=1,
+            fftsize=0, window="rect", bands=3):
+    audio = AudioFile(path, sample, fmt, channels)
+    try:
+        pipeline = Pipeline(audio.sample, fps, fftsize, window, bands)
+        chunk = pipeline.chunk
+        decoder = pcm.PCMDecoder(audio.format, audio.channels, chunk)
+        frame = analysis.Frame(pipeline.nspectrum, pipeline.names)
+        frames = np.zeros(audio.frames // chunk, dtype=frame.record.dtype)
+
+        start = time.perf_counter()
+        for i in range(0, len(frames)):
+            buf = audio.read(chunk)
+            if len(buf) < chunk * audio.frame_size:
+                frames = frames[:i]
+                break
+            # Timestamps are the position in the file of the last
+            # sample of the chunk, as a live capture would see it
+            pipeline.process(decoder.decode(buf),
+                float((i + 1) * chunk) / audio.sample, frames[i])
+        elapsed = time.perf_counter() - start
+    finally:
+        audio.close()
+
+    np.savez(features, frames=frames, version=analysis.VERSION,
+        sample=audio.sample, fps=fps, fftsize=fftsize, window=window,
+        bands=np.array(pipeline.names))
+
+    duration = float(len(frames) * chunk) / audio.sample
+    elapsed = max(elapsed, 1e-9)
+    return {
+        "frames" : len(frames),
+        "duration" : duration,
+        "elapsed" : elapsed,
+        "fps" : len(frames) / elapsed,
+        "frame_time" : elapsed / max(len(frames), 1),
+        "realtime" : duration / elapsed,
+    }
+
+# Load a feature file, returns (frames, parameters)
+def load(features):
+    data = np.load(features)
+    version = int(data["version"])
+    if version != analysis.VERSION:
+        raise ValueError("Unsupported feature file version: {0}".format(version))
+    params = {
+        "version" : version,
+        "sample" : int(data["sample"]),
+        "fps" : int(data["fps"]),
+        "fftsize" : int(data["fftsize"]),
+        "window" : str(data["window"]),
+        "bands" : [str(band) for band in data["bands"]],
+    }
+    return (data["frames"], params)
@@ -18,23 +18,31 @@ import glob
 import sys
 import importlib
 
-from .outputs import Outputs
+from .outputs import Outputs, read_manifest
 import log
 
 sys.path.append(os.path.dirname(__file__))
 
 outputs = Outputs()
 
+# Output modules are registered from their manifests and imported on
+# first use, so the graphics and DMX libraries are only loaded when an
+# output needing them is created.  Modules without a readable manifest
+# are imported right away.
 modules = glob.glob(os.path.dirname(__file__)+"/output_*.py")
 __all__ = []
-for module in modules:
+for module in sorted(modules):
+    name = os.path.basename(module)[:-3]
+    try:
+        outputs.register_lazy(name, read_manifest(module))
+        __all__.append(name)
+        continue
+    except Exception as e:
+        log.Logger().debug("No manifest in {0}: {1}".format(name, str(e)))
     try:
-        name = os.path.basename(module)[:-3]
         module = importlib.import_module(name)
         outputs.register(module)
         __all__.append(name)
     except Exception as e:
         log.Logger().debug("Failed to load {0}: {1}".format(name, str(e)))
         pass
-
-import helpers
@@ -0,0 +1,111 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import threading
+from collections import OrderedDict
+import numpy as np
+
+import filter
+
+# Spectrum as a (height, bands, 1) uint8 texture, every band is one
+# column with the intensity going from 0 at the bottom to 255 scaled
+# by the band level at the top
+class SpectrumTexture(object):
+    def __init__(self):
+        self._coef = {}
+
+    def __call__(self, data, height=128):
+        if height not in self._coef:
+            self._coef[height] = np.linspace(0, 255, height).reshape(height, 1)
+        texture = (data.spectrum * self._coef[height]).astype(np.uint8)
+        return texture.reshape(height, len(data.spectrum), 1)
+
+# Band levels smoothed with an exponential moving average, one array
+# over all bands.  The average moves one step per new frame, a frame
+# that fell out of the cache and is asked for again, or an older frame
+# asked for by a lagging output, gets the current value.  Sequence
+# numbers start over when the analyzer is restarted, a frame with a
+# lower sequence number but a later timestamp is from the new run.
+class SmoothedLevel(object):
+    def __init__(self):
+        self._ema = {}
+        self._last = {}
+
+    def __call__(self, data, alpha=0.5):
+        ema = self._ema.get(alpha)
+        if ema == None or len(ema.value) != len(data.level):
+            ema = filter.MultiEMA(alpha, len(data.level))
+            self._ema[alpha] = ema
+            self._last[alpha] = None
+        last = self._last[alpha]
+        if last == None or data.seq > last[0] or \
+                (data.seq < last[0] and data.timestamp > last[1]):
+            ema.add(data.level)
+            self._last[alpha] = (data.seq, data.timestamp)
+        return ema.value.copy()
+
+# Per-frame cache of products derived from analysis frames.  Outputs
+# ask for a product by name and parameters, the product is computed
+# the first time it's asked for in a frame and the same value is
+# returned to every output after that.  Frames are told apart by
+# sequence number and timestamp, the last few frames are kept so
+# outputs on worker threads lagging a frame behind still hit the
+# cache.  Returned arrays are read-only as they are shared.
+class Derived(object):
+    frames = 4
+
+    def __init__(self):
+        self._products = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.register("spectrum_texture", SpectrumTexture())
+        self.register("smoothed_level", SmoothedLevel())
+
+    # Register a product, fn(data, *args) computes it from a frame
+    def register(self, name, fn):
+        self._products[name] = fn
+
+    def products(self):
+        return sorted(self._products.keys())
+
+    # Return the product name computed from data with args
+    def get(self, data, name, *args):
+        if name not in self._products:
+            raise KeyError("No such derived product: {0}".format(name))
+        frame_key = (data.seq, data.timestamp)
+        key = (name,) + args
+        with self._lock:
+            cache = self._cache.get(frame_key)
+            if cache == None:
+                cache = {}
+                self._cache[frame_key] = cache
+                if len(self._cache) > self.frames:
+                    self._cache.popitem(last=False)
+            elif key in cache:
+                self.hits += 1
+                return cache[key]
+
+            value = self._products[name](data, *args)
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            cache[key] = value
+            self.misses += 1
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -13,23 +13,263 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
 
+# DMX output over Art-Net or E1.31 (sACN), any number of universes.
+# Outputs set the channels they drive every frame.  A universe is only
+# sent if a channel changed since it was last sent, or when the
+# keep-alive interval has passed so receivers don't time out.  All
+# universes due are sent together after the frame.
+#
+# By default universes are sent right after every analysis frame.
+# With a DMX refresh rate set they are sent from a clock of their own
+# instead, the analysis frames are handed over to the clock, which
+# holds the values of the last frame or moves towards them over one
+# frame interval.
+
+import time
+import threading
+import numpy as np
+
 from . import singleton
 from output import outputs
+from settings import Settings
+import dmxnet
+import log
+
+CHANNELS = dmxnet.CHANNELS
+
+# Parse a DMX address, either a channel number in universe 0 or a
+# string on the format universe:channel.  Returns (universe, channel),
+# raises ValueError if the address is invalid or the address and the
+# count - 1 channels following it don't fit in the universe.
+def address(value, count=1):
+    universe = 0
+    channel = value
+    if isinstance(value, str):
+        (first, sep, second) = value.partition(":")
+        try:
+            if sep:
+                (universe, channel) = (int(first), int(second))
+            else:
+                channel = int(first)
+        except ValueError:
+            raise ValueError("Invalid DMX address: {0}".format(value))
+    if universe < 0 or universe > 32767:
+        raise ValueError("Invalid DMX universe: {0}".format(universe))
+    if channel < 1 or channel + count - 1 > CHANNELS:
+        raise ValueError("DMX channels {0}-{1} out of range"\
+            .format(channel, channel + count - 1))
+    return (universe, channel)
+
+# Channel values of one universe for the current frame, indexed by
+# channel number.  The packet holds the values last sent.  With a
+# refresh clock, frames are committed as the target the values sent
+# hold or move towards.
+class Universe(object):
+    def __init__(self, number, packet):
+        self.number = number
+        self.packet = packet
+        self._data = np.zeros(CHANNELS + 1, dtype=np.uint8)
+        self._last = 0.0
+        self._target = np.zeros(CHANNELS, dtype=np.uint8)
+        self._origin = np.zeros(CHANNELS)
+        self._value = np.zeros(CHANNELS, dtype=np.uint8)
+        self._committed = 0.0
+
+    def set(self, channel, value):
+        self._data[channel] = value
+
+    # Copy values into the packet if they differ from the last ones
+    # sent or keepalive seconds have passed.  Returns True if the
+    # packet is to be sent.
+    def _due(self, values, now, keepalive):
+        due = not np.array_equal(values, self.packet.data)
+        if due:
+            self.packet.data[:] = values
+        if due or now - self._last >= keepalive:
+            self._last = now
+            due = True
+        return due
+
+    # Send the current frame if due and clear the frame
+    def flush(self, now, keepalive):
+        due = self._due(self._data[1:], now, keepalive)
+        self._data.fill(0)
+        return due
+
+    # Make the current frame the target of the refresh clock, moving
+    # from the values at now if interpolating, and clear the frame
+    def commit(self, now, interval):
+        if interval > 0:
+            self._origin[:] = self.value(now, interval)
+        self._target[:] = self._data[1:]
+        self._committed = now
+        self._data.fill(0)
+
+    # Values at now, the target or interval seconds into the move
+    # from the previous values to it
+    def value(self, now, interval):
+        if interval <= 0 or now - self._committed >= interval:
+            return self._target
+        frac = (now - self._committed) / interval
+        np.copyto(self._value, np.rint(self._origin +
+            (self._target - self._origin) * frac), casting="unsafe")
+        return self._value
+
+    # Send the values of the refresh clock if due
+    def tick(self, now, interval, keepalive):
+        return self._due(self.value(now, interval), now, keepalive)
 
-import artnet
+    # Clear all values
+    def clear(self):
+        self._data.fill(0)
+        self._target.fill(0)
+        self._origin.fill(0)
+
+    # Move to a new packet, keeping the values last sent
+    def rebind(self, packet):
+        packet.data[:] = self.packet.data
+        self.packet = packet
+        self._last = 0.0
+
+# Sends the universes at a steady rate
+class RefreshClock(threading.Thread):
+    def __init__(self, dmx, rate):
+        super(RefreshClock, self).__init__(name="dmx-refresh")
+        self.daemon = True
+        self._dmx = dmx
+        self._period = 1.0 / rate
+        self._done = threading.Event()
+
+    def run(self):
+        period = self._period
+        deadline = time.monotonic()
+        while not self._done.wait(max(0.0, deadline - time.monotonic())):
+            now = time.monotonic()
+            self._dmx._tick(now)
+            deadline += period
+            # Skip ticks missed rather than sending a burst
+            if deadline < now:
+                deadline = now + period
+
+    def stop(self):
+        self._done.set()
+        self.join()
 
 @singleton
 class ArtnetDmx(object):
+    # Seconds between resends of unchanged universes
+    keepalive = 1.0
+
     def __init__(self):
-        self._ac = artnet.Controller("chromesthesia")
-        self.dmx = artnet.port.DMX(direction=artnet.port.DMX.INPUT)
-        self._ac.add_port(self.dmx)
+        self.universes = {}
+        self._transport = dmxnet.Transport()
+        self._lock = threading.Lock()
+        self._clock = None
+        self._interpolate = False
+        self._interval = 0.0
+        self._updated = None
+        self.errors = 0
+        settings = Settings()
+        settings.create("dmx_keepalive", self.keepalive,
+            self._set_keepalive, type=float, min=0.0)
+        settings.create("dmx_protocol", "artnet", self._set_transport,
+            values=sorted(dmxnet.protocols.keys()))
+        settings.create("dmx_host", "", self._set_transport)
+        settings.create("dmx_rate", 0.0, self._set_clock, type=float,
+            min=0.0, max=1000.0)
+        settings.create("dmx_smooth", "hold", self._set_clock,
+            values=["hold", "interpolate"])
         outputs.register_helper(self)
 
+    def _set_keepalive(self, key, value):
+        self.keepalive = value
+
+    # Destination host, empty for broadcast (Art-Net) or multicast (sACN)
+    def _set_transport(self, key, value):
+        settings = Settings()
+        try:
+            transport = dmxnet.Transport(settings["dmx_protocol"],
+                settings["dmx_host"] or None)
+        except (OSError, ValueError) as e:
+            raise ValueError("Invalid DMX transport: {0}".format(str(e)))
+        with self._lock:
+            for universe in self.universes.values():
+                universe.rebind(transport.packet(universe.number))
+            self._transport.close()
+            self._transport = transport
+
+    # Refresh rate in Hz, 0 sends after every analysis frame
+    def _set_clock(self, key, value):
+        settings = Settings()
+        if self._clock != None:
+            self._clock.stop()
+            self._clock = None
+        self._interpolate = settings["dmx_smooth"] == "interpolate"
+        self._updated = None
+        self._interval = 0.0
+        if settings["dmx_rate"] > 0:
+            self._clock = RefreshClock(self, settings["dmx_rate"])
+            self._clock.start()
+
+    # Return universe number, created on first use
+    def universe(self, number):
+        with self._lock:
+            if number not in self.universes:
+                self.universes[number] = Universe(number,
+                    self._transport.packet(number))
+            return self.universes[number]
+
+    def _send(self, packets):
+        try:
+            self._transport.send(packets)
+        except OSError as e:
+            self.errors += 1
+            log.Logger().debug("DMX send failed: {0}".format(str(e)))
+
+    # Called from the refresh clock
+    def _tick(self, now):
+        with self._lock:
+            interval = self._interval if self._interpolate else 0.0
+            keepalive = self.keepalive
+            packets = [universe.packet for universe in self.universes.values()
+                if universe.tick(now, interval, keepalive)]
+            if packets:
+                self._send(packets)
+
     def after_stop(self):
-        self.dmx.reset()
-        self.dmx.send()
+        with self._lock:
+            packets = []
+            for universe in self.universes.values():
+                universe.clear()
+                universe.flush(0.0, 0.0)
+                packets.append(universe.packet)
+            self._send(packets)
+            self._updated = None
+            self._interval = 0.0
 
     def after_update(self):
-        self.dmx.send()
-        self.dmx.reset()
+        now = time.monotonic()
+        if self._clock == None:
+            # The transport may be replaced from the console meanwhile
+            with self._lock:
+                keepalive = self.keepalive
+                packets = [universe.packet
+                    for universe in self.universes.values()
+                    if universe.flush(now, keepalive)]
+                if packets:
+                    self._send(packets)
+            return
+
+        # Interval between analysis frames, the time taken to move to
+        # the values of a new frame
+        with self._lock:
+            if self._updated != None:
+                dt = now - self._updated
+                if self._interval > 0:
+                    self._interval += 0.1 * (dt - self._interval)
+                else:
+                    self._interval = dt
+            self._updated = now
+            interval = self._interval if self._interpolate else 0.0
+            for universe in self.universes.values():
+                universe.commit(now, interval)
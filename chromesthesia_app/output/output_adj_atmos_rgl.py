@@ -44,11 +44,14 @@ alias = "adj_atmos_rgl"
 name = "American DJ Atmospheric RG LED"
 desc = name
 
+workers = ("inline",)
+
 config = {
     "channel" : {
-        "type" : int,
+        "type" : (int, str),
         "default" : 1,
-        "help" : "DMX channel to use, will use the channel above aswell"
+        "help" : "DMX channel or universe:channel to use, will use the "
+            "channel above aswell"
     }
 }
 
@@ -72,35 +75,45 @@ class Output(object):
     clockwise = True
 
     def __init__(self, config):
-        self._color_channel = config["channel"]
-        self._rotation_channel = config["channel"] + 1
-        self._helper = helpers.ArtnetDmx()
+        (universe, channel) = helpers.address(config["channel"], 2)
+        self._color_channel = channel
+        self._rotation_channel = channel + 1
+        self._dmx = helpers.ArtnetDmx().universe(universe)
+        self._values = (0, 0)
+
+    def _set(self, color, rotation):
+        self._values = (color, rotation)
+        self._dmx.set(self._color_channel, color)
+        self._dmx.set(self._rotation_channel, rotation)
 
     def update(self, data, dt):
-        if data["silence"]:
-            self._helper.dmx.set(self._color_channel, 0)
-            self._helper.dmx.set(self._rotation_channel, 0)
+        if data.silence:
+            self._set(0, 0)
             self.clockwise = True if random.randint(0,1) else False
             return
 
         color = 0
 
-        if data["bins"]["bass"]["transient"] > 0:
+        if data.bins.bass.transient > 0:
             color |= self.RED
 
-        if data["bins"]["mid"]["level"] >= 0.20:
+        if data.bins.mid.level >= 0.20:
             color |= self.GREEN
 
         if color == 0:
             color |= self.BLUE
 
-        mid = data["bins"]["mid"]["level"] * 100
+        mid = data.bins.mid.level * 100
         speed = int((pow(mid, 2.0) / pow(100, 2.0)) * 55)
         if self.clockwise:
             rotation = 135 + speed + 55
         else:
             rotation = abs(speed - 110) + 10 + 55
 
-        self._helper.dmx.set(self._color_channel, self.colormap[color])
-        self._helper.dmx.set(self._rotation_channel, rotation)
+        self._set(self.colormap[color], rotation)
+
+    # The universe is cleared after every frame, frames skipped by the
+    # rate cap repeat the last values
+    def hold(self):
+        self._set(*self._values)
 
@@ -14,17 +14,19 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
 
 import helpers
+from output import outputs
 
 alias = "rgb_led_dmx"
 name = "DMX controlled RGB LED strip"
 desc = name
 
+workers = ("inline",)
+
 config = {
     "channel" : {
-        "type" : int,
+        "type" : (int, str),
         "default" : 1,
-        "values" : range(1, 512),
-        "help" : "Base DMX channel, requires 3 channels"
+        "help" : "Base DMX channel or universe:channel, requires 3 channels"
     },
     "mode" : {
         "type" : str,
@@ -50,31 +52,35 @@ config = {
 
 class Output(object):
     def __init__(self, config):
-        self._helper = helpers.ArtnetDmx()
+        (universe, channel) = helpers.address(config["channel"], 3)
+        self._dmx = helpers.ArtnetDmx().universe(universe)
 
         self._mode = config["mode"]
         self._channels = {
-            "red" : config["channel"],
-            "green" : config["channel"] + 1,
-            "blue" : config["channel"] + 2
+            "red" : channel,
+            "green" : channel + 1,
+            "blue" : channel + 2
         }
         self._src = {
             "red" : config["red"],
             "green" : config["green"],
             "blue" : config["blue"]
         }
-
-        self._level = 0
+        # Channel values of the last update
+        self._values = {}
 
     def update(self, data, dt):
-        if data["silence"]:
+        self._values = {}
+        if data.silence:
             return
 
+        # Band levels smoothed once per frame for all instances
+        levels = outputs.derived.get(data, "smoothed_level", 0.5)
+        names = data.bins.keys()
         for src in self._src:
-            d = data["bins"][self._src[src]]
-            trans = int(d["transient"] * 255)
-            self._level = (self._level + d["level"]) / 2
-            level = int(self._level * 255)
+            d = getattr(data.bins, self._src[src])
+            trans = int(d.transient * 255)
+            level = int(levels[names.index(d.name)] * 255)
 
             if trans > 0 and self._mode in ["beat", "mix"]:
                 color = trans
@@ -83,4 +89,11 @@ class Output(object):
             else:
                 color = 0
 
-            self._helper.dmx.set(self._channels[src], color)
+            self._values[self._channels[src]] = color
+            self._dmx.set(self._channels[src], color)
+
+    # The universe is cleared after every frame, frames skipped by the
+    # rate cap repeat the last values
+    def hold(self):
+        for channel in self._values:
+            self._dmx.set(channel, self._values[channel])
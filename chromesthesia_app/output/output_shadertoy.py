@@ -22,14 +22,22 @@ import datetime as dt
 import time
 import random
 import os
+import sys
 from OpenGL import GL, constant
 from OpenGL.GL.ARB import debug_output
 from OpenGL.extensions import alternate
 
+if __name__ == '__main__':
+    sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from output import outputs
+
 alias = "shadertoy"
 name = "Shadertoy"
 desc = "Shadertoy visualizer, using shaders from shadertoy.com"
 
+# SDL_GL_SwapWindow() waits for vsync
+workers = ("thread", "process", "inline")
+
 vertex = """
 #version 120
 
@@ -289,10 +297,13 @@ class Program(object):
 
 class Output(object):
     def __init__(self, config):
-        pass
+        self.window = None
+        self._suspended = False
 
     def on_start(self):
         self.window = Window(title=b"Shadertoy")
+        if self._suspended:
+            sdl2.SDL_HideWindow(self.window.window)
 
         path = os.path.join(os.path.dirname(__file__), "shadertoy")
         for file in os.listdir(path):
@@ -321,39 +332,53 @@ class Output(object):
         self.window.close()
         self.window = None
 
+    # In standby the window is hidden, its events are still handled so
+    # the window manager doesn't take it for hung
+    def on_suspend(self):
+        self._suspended = True
+        if self.window:
+            sdl2.SDL_HideWindow(self.window.window)
+
+    def on_resume(self):
+        self._suspended = False
+        if self.window:
+            sdl2.SDL_ShowWindow(self.window.window)
+
+    def idle(self):
+        if self.window:
+            self.handle_events()
+
+    def handle_events(self):
+        for event in sdl2.ext.get_events():
+            self.window.on_event(event)
+
     def update(self, data, dt):
         if not self.window:
             return
         self._time -= dt
 
         if self._time <= 0.0:
-            if data["silence"] or data["bins"]["bass"]["transient"] == 1.0:
+            if data.silence or data.bins.bass.transient == 1.0:
                 self._time = random.randint(7, 15)
                 self.select_program()
 
-        flux = ((data["bins"]["bass"]["flux"]*2 + data["bins"]["mid"]["flux"] + \
-            data["bins"]["tre"]["flux"]) / 4) / 0.025
+        bins = data.bins
+        flux = ((bins.bass.flux*2 + bins.mid.flux + bins.tre.flux) / 4) / 0.025
         flux = min(2.0, flux)
 
         self.window.program["iGlobalTime"] += (flux * dt)
 
-        # Transform the spectrum data into a 2D texture with the
-        # dimensions (len(spectrum), height).  Each band represent one
-        # point on the x axis with the y axis holding the intensity
-        # represented by the color values 0 to 255
-        height = 128
-        spectrum = np.array(data["spectrum"])
-        coef = np.linspace(0, 255, height).reshape(height, 1)
-        spectrum = (spectrum * coef).astype(np.uint8)
-        spectrum = spectrum.reshape(height, len(data["spectrum"]), 1)
+        # The spectrum as a 2D texture with the dimensions
+        # (len(spectrum), 128).  Each band represent one point on the
+        # x axis with the y axis holding the intensity represented by
+        # the color values 0 to 255, shared with other instances
+        spectrum = outputs.derived.get(data, "spectrum_texture", 128)
 
         # Update iChannel0 texture with spectrum data
         self.window.set_channel_input(0, spectrum)
 
         self.window.draw()
-        events = sdl2.ext.get_events()
-        for event in events:
-            self.window.on_event(event)
+        self.handle_events()
 
 # Generate a (pretty bad) test pattern for debugging
 if __name__ == '__main__':
@@ -361,27 +386,21 @@ if __name__ == '__main__':
     o = Output({})
     o.on_start()
 
-    data = {
-        "bins" : {},
-        "spectrum" : [0] * 8,
-        "silence" : False
-    }
+    import analysis
 
-    bins = ["bass", "mid", "tre"]
-    for bin in bins:
-        data["bins"][bin] = {
-            "level" : 0.0,
-            "flux" : 0.1,
-            "transient" : 0.0
-        }
+    data = analysis.Frame(8)
+    data.silence = False
+    for bin in data.bins:
+        bin.flux = 0.1
 
     spectrum_step = [0.008, 0.007, 0.006, 0.005, 0.004, 0.003, 0.002, 0.001]
 
     bin = 0
     for i in range(0, 60):
+        data.seq += 1
         o.update(data, 1.0/fps)
-        data["spectrum"] = np.add(data["spectrum"], spectrum_step)
-        data["spectrum"] = np.mod(data["spectrum"], 1.0)
+        np.add(data.spectrum, spectrum_step, out=data.spectrum)
+        np.mod(data.spectrum, 1.0, out=data.spectrum)
         time.sleep(1.0/fps)
 
     o.on_stop()
@@ -389,7 +408,8 @@ if __name__ == '__main__':
     time.sleep(1)
     o.on_start()
     while True:
+        data.seq += 1
         o.update(data, 1.0/fps)
-        data["spectrum"] = np.add(data["spectrum"], spectrum_step)
-        data["spectrum"] = np.mod(data["spectrum"], 1.0)
+        np.add(data.spectrum, spectrum_step, out=data.spectrum)
+        np.mod(data.spectrum, 1.0, out=data.spectrum)
         time.sleep(1.0/fps)
@@ -20,6 +20,9 @@ alias = "simplevis"
 name = "Simple visualizer"
 desc = "Simple graphical visualizer, suitable for testing"
 
+# flip() waits for vsync
+workers = ("thread", "process", "inline")
+
 class SimpleVis(pyglet.window.Window):
     def __init__(self, width, height):
         config = pyglet.gl.Config(sample_buffers=1, samples=4)
@@ -39,13 +42,13 @@ class SimpleVis(pyglet.window.Window):
         shapes = []
         x = self.begin
         width = self.barwidth
-        for bin in "bass", "mid", "tre":
-            d = self.data["bins"][bin]
-            level = int(d["level"] * self.barheight)
-            flux =  int(d["flux"] * self.barheight)
-            trans = int(d["transient"] * 255)
+        bins = self.data.bins
+        for d in bins.bass, bins.mid, bins.tre:
+            level = int(d.level * self.barheight)
+            flux =  int(d.flux * self.barheight)
+            trans = int(d.transient * 255)
 
-            if not self.data["silence"]:
+            if not self.data.silence:
                 shapes.append(Shape.circle([x + self.beatradius, self.beaty],
                     self.beatradius, color=(0, trans, 0)))
 
@@ -57,9 +60,9 @@ class SimpleVis(pyglet.window.Window):
             x += int(width * 1.5)
 
         x += self.barwidth
-        width = int((self.width - x) / (len(self.data["spectrum"]) + 1))
+        width = int((self.width - x) / (len(self.data.spectrum) + 1))
         g = 0
-        for level in self.data["spectrum"]:
+        for level in self.data.spectrum:
             level = int(level * self.barheight)
 
             shapes.append(
@@ -72,20 +75,39 @@ class SimpleVis(pyglet.window.Window):
 
 class Output(object):
     def __init__(self, config):
+        self._suspended = False
+
+    # The window and its GL context are created on the thread that
+    # runs the output
+    def on_enable(self):
+        self.window = SimpleVis(width=512, height=200)
         pyglet.gl.glBlendFunc(pyglet.gl.GL_SRC_ALPHA,
                               pyglet.gl.GL_ONE_MINUS_SRC_ALPHA)
         pyglet.gl.glEnable(pyglet.gl.GL_BLEND)
         pyglet.gl.glEnable(pyglet.gl.GL_LINE_SMOOTH)
         pyglet.gl.glHint(pyglet.gl.GL_LINE_SMOOTH_HINT, pyglet.gl.GL_NICEST)
         pyglet.gl.glLineWidth(3)
-
-    def on_enable(self):
-        self.window = SimpleVis(width=512, height=200)
+        if self._suspended:
+            self.window.set_visible(False)
 
     def on_disable(self):
         self.window.close()
         self.window = None
 
+    # In standby the window is hidden, its events are still dispatched
+    # so the window manager doesn't take it for hung
+    def on_suspend(self):
+        self._suspended = True
+        self.window.set_visible(False)
+
+    def on_resume(self):
+        self._suspended = False
+        self.window.set_visible(True)
+
+    def idle(self):
+        self.window.switch_to()
+        self.window.dispatch_events()
+
     def update(self, data, dt):
         self.window.data = data
         pyglet.clock.tick()
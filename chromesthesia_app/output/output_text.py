@@ -42,10 +42,8 @@ class Output(object):
             return
         self._counter = 0
         string = "dt:{:.3f} ".format(dt)
-        for bin in "bass", "mid", "tre":
-            string += "{:s}: l:{:.3f} f:{:.3f} t:{:.3f} ".format(bin,
-                data["bins"][bin]["level"],
-                data["bins"][bin]["flux"],
-                data["bins"][bin]["transient"]
-            )
+        bins = data.bins
+        for bin in bins.bass, bins.mid, bins.tre:
+            string += "{:s}: l:{:.3f} f:{:.3f} t:{:.3f} ".format(bin.name,
+                bin.level, bin.flux, bin.transient)
         print(string)
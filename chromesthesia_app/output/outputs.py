@@ -13,9 +13,107 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
 
+import ast
 import time
+import signal
+import threading
+import importlib
+import functools
+import multiprocessing
+from select import select
 
 from command import Command, CmdBranch, command_root
+import analysis
+import ring
+import log
+from .timing import Timing
+from .derived import Derived
+
+# Options available for every output instance, next to the options
+# of the output module
+instance_config = {
+    "worker" : {
+        "type" : str,
+        "default" : None,
+        "values" : ["inline", "thread", "process"],
+        "help" : "Run the output on the main loop, its own thread or process"
+    },
+    "max_fps" : {
+        "type" : (int, float),
+        "default" : 0,
+        "help" : "Most updates per second, 0 for every frame"
+    },
+    "after" : {
+        "type" : str,
+        "default" : None,
+        "help" : "Instance to update before this one"
+    },
+}
+
+# Hooks helpers may implement, called around the output hooks
+helper_hooks = ("before_start", "after_start", "before_stop", "after_stop",
+    "before_update", "after_update")
+
+# Order items so that every item comes after the items returned by
+# depends(item), otherwise keeping the original order.  Dependencies
+# on items not in the list are ignored.
+def _ordered(items, depends):
+    result = []
+    placed = set()
+    pending = list(items)
+    while pending:
+        for item in pending:
+            if all(dep in placed or dep not in pending
+                    for dep in depends(item)):
+                break
+        else:
+            log.Logger().debug("Circular output dependencies, ignoring order")
+            result.extend(pending)
+            break
+        pending.remove(item)
+        placed.add(item)
+        result.append(item)
+    return result
+
+# Module level names making up the manifest of an output module and
+# the names the manifest values may refer to.  The manifest is read
+# from the source so modules can be listed without importing them.
+manifest_keys = ("alias", "name", "desc", "workers", "config")
+manifest_names = {
+    "int" : int,
+    "float" : float,
+    "str" : str,
+    "bool" : bool,
+    "range" : range,
+}
+
+# Read the manifest of the output module at path, returns a dict with
+# the manifest keys found.  Raises ValueError if the manifest can't be
+# evaluated without running the module.
+def read_manifest(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+
+    manifest = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+            continue
+        target = node.targets[0]
+        if not isinstance(target, ast.Name) or \
+                target.id not in manifest_keys or target.id in manifest:
+            continue
+        scope = dict(manifest_names)
+        scope.update(manifest)
+        try:
+            manifest[target.id] = eval(compile(ast.Expression(node.value),
+                path, "eval"), {"__builtins__" : {}}, scope)
+        except Exception as e:
+            raise ValueError("Invalid manifest entry '{0}': {1}"\
+                .format(target.id, str(e)))
+
+    if "alias" not in manifest:
+        raise ValueError("No alias in {0}".format(path))
+    return manifest
 
 class CmdOutputModules(Command):
     def __init__(self):
@@ -81,11 +179,8 @@ class CmdOutputCreate(Command):
         self.name = module.alias
         self._module = module
     def hints(self):
-        try:
-            config = self._module.config
-            return list(config.keys())
-        except:
-            return []
+        return list(self._module.config.keys()) + \
+            list(instance_config.keys())
     def execute(self):
         tokens = self.tokens
         if len(tokens) % 3:
@@ -131,23 +226,168 @@ class CmdOutputDestroy(Command):
         else:
             return ["Failed to destroy output '{:s}'".format(instance_name)]
 
+class CmdSceneCreate(Command):
+    def __init__(self):
+        super(CmdSceneCreate, self).__init__()
+        self.name = "create"
+    def hints(self):
+        inst = self.storage["output"].instances()
+        return list(map(lambda x: x.name, inst))
+    def execute(self):
+        if len(self.tokens) < 2:
+            raise Command.SyntaxError(
+                "Use output scene create <name> <instance> [instance ...]")
+        name = self.tokens[0][1]
+        instances = list(map(lambda x: x[1], self.tokens[1:]))
+
+        output = self.storage["output"]
+        (result, msg) = output.create_scene(name, instances)
+        if result:
+            return ["Scene '{:s}' created".format(name)]
+        else:
+            return ["Failed to create scene: {:s}".format(msg)]
+
+class CmdSceneDestroy(Command):
+    def __init__(self):
+        super(CmdSceneDestroy, self).__init__()
+        self.name = "destroy"
+    def hints(self):
+        return self.storage["output"].scenes()
+    def execute(self):
+        if len(self.tokens) != 1:
+            raise Command.SyntaxError("Scene name required")
+        name = self.tokens[0][1]
+
+        output = self.storage["output"]
+        if output.destroy_scene(name):
+            return ["Scene '{:s}' destroyed".format(name)]
+        else:
+            return ["Failed to destroy scene '{:s}'".format(name)]
+
+class CmdSceneSwitch(Command):
+    def __init__(self):
+        super(CmdSceneSwitch, self).__init__()
+        self.name = "switch"
+    def hints(self):
+        return self.storage["output"].scenes()
+    def execute(self):
+        if len(self.tokens) != 1:
+            raise Command.SyntaxError("Scene name required")
+        name = self.tokens[0][1]
+
+        output = self.storage["output"]
+        if output.switch_scene(name):
+            return ["Switched to scene '{:s}'".format(name)]
+        else:
+            return ["Failed to switch to scene '{:s}'".format(name)]
+
+class CmdSceneList(Command):
+    def __init__(self):
+        super(CmdSceneList, self).__init__()
+        self.name = "list"
+    def execute(self):
+        output = self.storage["output"]
+        list = ["Scenes:"]
+        for name in output.scenes():
+            list.append(" {:s}{:s}: {:s}".format(name,
+                " (active)" if name == output.scene else "",
+                ", ".join(output.scene_instances(name))))
+        return list
+
+class CmdOutputStats(Command):
+    def __init__(self):
+        super(CmdOutputStats, self).__init__()
+        self.name = "stats"
+    def hints(self):
+        return ["on", "off", "reset"]
+    def execute(self):
+        output = self.storage["output"]
+        if len(self.tokens) > 1:
+            raise Command.SyntaxError("Use output stats [on|off|reset]")
+        if len(self.tokens) == 1:
+            action = self.tokens[0][1]
+            if action == "on":
+                output.stats = True
+            elif action == "off":
+                output.stats = False
+            elif action == "reset":
+                output.reset_stats()
+            else:
+                raise Command.SyntaxError("Use output stats [on|off|reset]")
+            return ["Output stats {:s}".format(action)]
+
+        if not output.stats:
+            return ["Output stats are off, enable with output stats on"]
+        elapsed = output.stats_elapsed()
+        list = ["Output stats over {:.1f}s, deadline {:.1f} ms:".format(
+            elapsed, output.deadline * 1000),
+            " {:<16s} {:<13s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s} {:>6s} {:>7s}"\
+            .format("name", "call", "rate/s", "mean ms", "p50 ms", "p99 ms",
+                "max ms", "missed", "dropped")]
+        for (name, call, timing, dropped) in output.timings():
+            s = timing.summary(elapsed)
+            if not s["calls"] and dropped == None:
+                continue
+            list.append(" {:<16s} {:<13s} {:8.1f} {:8.3f} {:8.3f} {:8.3f} "\
+                "{:8.3f} {:6d} {:>7s}".format(name, call, s["rate"],
+                s["mean"] * 1000, s["p50"] * 1000, s["p99"] * 1000,
+                s["max"] * 1000, s["missed"],
+                str(dropped) if dropped != None else "-"))
+        return list
+
+# An output module known by its manifest, the module itself is
+# imported by load on first use.
 class OutputModule(object):
-    def __init__(self, module):
-        self.module = module
+    def __init__(self, manifest, load, modname):
+        self.manifest = manifest
+        self._load = load
+        # Name the module is imported by in an output process
+        self.modname = modname
+        self._module = None
         self._instances = {}
         self._indices = [-1]
 
+    @property
+    def module(self):
+        if self._module == None:
+            try:
+                self._module = self._load()
+            except Exception as e:
+                raise RuntimeError("Could not load output module {0}: {1}"\
+                    .format(self.alias, str(e)))
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module != None
+
     @property
     def alias(self):
-        return self.module.alias
+        return self.manifest["alias"]
 
     @property
     def name(self):
-        return self.module.name
+        return self.manifest.get("name", self.alias)
 
     @property
     def desc(self):
-        return self.module.desc
+        return self.manifest.get("desc", self.name)
+
+    @property
+    def config(self):
+        return self.manifest.get("config", {})
+
+    # Supported ways of running instances, the first one is the default.
+    # Outputs writing to shared helpers such as ArtnetDmx must run
+    # inline so the helpers are flushed after they have updated, and
+    # outputs blocking on the display, for example waiting for vsync,
+    # are best run on a worker so they can't hold up the lighting.
+    # Outputs creating their window and GL state in the hooks rather
+    # than on import can run as a process, the window and context then
+    # belong to the child, the only process importing the module.
+    @property
+    def workers(self):
+        return self.manifest.get("workers", ("inline", "thread", "process"))
 
     def create(self, user_config):
         indices = self._indices
@@ -163,33 +403,39 @@ class OutputModule(object):
         if instance_name in self._instances:
             return (False, "Instance already exists: {0}".format(instance_name))
 
-        try:
-            module_config = self.module.config
-        except:
-            module_config = {}
-
+        module_config = self.config
         config = {}
         for key in module_config:
             try:
-                config[key] = self.module.config[key]["default"]
+                config[key] = module_config[key]["default"]
             except:
                 pass
+        options = {}
+        for key in instance_config:
+            options[key] = instance_config[key]["default"]
+        options["worker"] = self.workers[0]
 
         for key in user_config:
-            if key not in config:
+            if key in instance_config:
+                (target, spec) = (options, instance_config[key])
+            elif key in config:
+                (target, spec) = (config, module_config[key])
+            else:
                 continue
             value = user_config[key]
-            if "type" in module_config[key] and \
-                not isinstance(value, module_config[key]["type"]):
+            if "type" in spec and not isinstance(value, spec["type"]):
                 return (False, "Wrong data type for option '{0}'".format(key))
-            if "values" in module_config[key] and \
-                value not in module_config[key]["values"]:
+            if "values" in spec and value not in spec["values"]:
                 return (False, "Invalid value for '{0}': {1}".format(key, value))
 
-            config[key] = value
+            target[key] = value
+
+        if options["worker"] not in self.workers:
+            return (False, "{0} can't run as '{1}'".format(self.alias,
+                options["worker"]))
 
         try:
-            instance = OutputInstance(self, instance_name, config)
+            instance = OutputInstance(self, instance_name, config, options)
         except Exception as e:
             return (False, "Could not create instance: {0}".format(str(e)))
         self._instances[instance_name] = {
@@ -205,12 +451,392 @@ class OutputModule(object):
         del self._instances[name]
         return True
 
+# Call fn, timing the call if timing is active
+def _timed_call(fn, timing, *args):
+    if timing == None or not timing.active:
+        return fn(*args)
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timing.add(time.perf_counter() - start)
+
+# Caps the update rate of an instance at max_fps.  Updates are due at
+# deadlines one interval apart rather than one interval after the last
+# update, so a frame arriving a little early doesn't push the update
+# to the frame after and the rate stays at the cap despite jitter.  An
+# instance falling more than an interval behind starts over from now.
+class RateCap(object):
+    def __init__(self, max_fps):
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._deadline = None
+
+    # Seconds until the next update is due, 0 if due now
+    def wait(self, now):
+        if not self.interval or self._deadline == None:
+            return 0.0
+        return max(0.0, self._deadline - now)
+
+    # Record an update at now
+    def take(self, now):
+        if not self.interval:
+            return
+        if self._deadline == None or now - self._deadline > self.interval:
+            self._deadline = now + self.interval
+        else:
+            self._deadline += self.interval
+
+# Seconds between idle() calls of suspended instances, which lets
+# outputs owning a window keep handling its events
+idle_interval = 0.1
+
+# Runs an output instance on its own thread.  Frames are handed over
+# through a single slot mailbox that always holds the latest frame,
+# frames replaced before the worker picked them up are counted as
+# dropped.  All hooks of the instance are called on the worker thread,
+# in order with the frames, which keeps outputs owning a window or a
+# GL context on one thread.
+class OutputWorker(object):
+    def __init__(self, instance, name, max_fps=0, timings=None):
+        self._instance = instance
+        self._timings = timings if timings != None else {}
+        self._cond = threading.Condition()
+        self._calls = []
+        self._mailbox = None
+        self._frame = None
+        self._pending = False
+        self._running = True
+        self._suspended = False
+        self._cap = RateCap(max_fps)
+        self._last = None
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run,
+            name="output-" + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Queue a call of one of the on_* hooks of the instance
+    def call(self, hook):
+        with self._cond:
+            self._calls.append(hook)
+            self._cond.notify()
+
+    # Replace the frame in the mailbox with a copy of data
+    def post(self, data):
+        with self._cond:
+            mailbox = self._mailbox
+            if mailbox == None or mailbox.record.dtype != data.record.dtype:
+                mailbox = analysis.Frame(len(data.spectrum), data.bins.keys())
+                self._mailbox = mailbox
+            if self._pending:
+                self.dropped += 1
+            mailbox.record[...] = data.record
+            mailbox.seq = data.seq
+            self._pending = True
+            self._cond.notify()
+
+    # Stop the worker once the queued hooks have been called
+    def close(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    # Copy the mailbox to the frame owned by the worker thread
+    def _take(self):
+        mailbox = self._mailbox
+        frame = self._frame
+        if frame == None or frame.record.dtype != mailbox.record.dtype:
+            frame = analysis.Frame(len(mailbox.spectrum), mailbox.bins.keys())
+            self._frame = frame
+        frame.record[...] = mailbox.record
+        self._pending = False
+        return frame.load(mailbox.seq)
+
+    def _run(self):
+        while True:
+            frame = None
+            with self._cond:
+                while self._running and not self._calls and not self._pending:
+                    if not self._suspended:
+                        self._cond.wait()
+                    elif not self._cond.wait(idle_interval):
+                        self._calls.append("idle")
+                calls = self._calls
+                self._calls = []
+                if self._pending and self._running:
+                    # Rate capped, leave the frame in the mailbox
+                    wait = self._cap.wait(time.monotonic())
+                    if wait and not calls:
+                        self._cond.wait(wait)
+                        continue
+                    frame = self._take()
+                elif not self._running and not calls:
+                    return
+
+            for hook in calls:
+                if hook in ("on_suspend", "on_resume"):
+                    self._suspended = hook == "on_suspend"
+                try:
+                    _timed_call(getattr(self._instance, hook),
+                        self._timings.get(hook))
+                except AttributeError:
+                    pass
+                except Exception as e:
+                    log.Logger().debug("Output {0} failed: {1}".format(hook,
+                        str(e)))
+
+            if frame != None:
+                now = time.monotonic()
+                dt = now - self._last if self._last != None else 0.0
+                self._last = now
+                self._cap.take(now)
+                try:
+                    _timed_call(self._instance.update,
+                        self._timings.get("update"), frame, dt)
+                except Exception as e:
+                    log.Logger().debug("Output update failed: {0}"\
+                        .format(str(e)))
+
+# Output processes are started from a fork server, or spawned where
+# there is none, rather than forked from the main process.  Outputs
+# are enabled while the console, worker and DMX threads run, and a
+# fork could copy a lock one of them holds into the child.
+_mp = multiprocessing.get_context("forkserver"
+    if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Runs an output instance in a child process, which keeps its work
+# off the GIL of the main process.  The instance is created in the
+# child, which imports the output module by name, and frames are
+# passed through a shared memory FrameRing, the child always picks the
+# latest frame.  Hooks and record layout changes are sent over a
+# control pipe.
+#
+# A frame layout that doesn't fit the ring restarts the child with a
+# ring large enough for it, the hooks that set up the instance are
+# called again in the new child.
+class OutputProcess(object):
+    # Shared memory reserved for the frame ring
+    ring_capacity = 256 * 1024
+    slots = 4
+
+    def __init__(self, output, config, name, max_fps=0, timings=None):
+        self._args = (output, config, max_fps)
+        self._name = name
+        self._timings = timings if timings != None else {}
+        self._hooks = []
+        self._lost = 0
+        self._failed = False
+        self._spawn(self.ring_capacity)
+
+    def _spawn(self, capacity):
+        (output, config, max_fps) = self._args
+        self._ring = ring.FrameRing(analysis.dtype(len(analysis.BANDS), 0),
+            size=self.slots, capacity=capacity)
+        self._generation = 0
+        # Frames dropped and failed calls, updated by the child
+        self._counters = _mp.Array('l', 2, lock=False)
+        (control, self._control) = _mp.Pipe()
+        self._process = _mp.Process(target=_host,
+            args=(output.modname, config, max_fps, self._ring,
+                self._counters, self._timings, control),
+            name="output-" + self._name)
+        self._process.daemon = True
+        self._process.start()
+        control.close()
+
+        # Wait for the child to create the instance
+        reply = ("error", "Output process didn't start")
+        try:
+            if self._control.poll(10.0):
+                reply = self._control.recv()
+        except EOFError:
+            pass
+        if reply[0] != "ready":
+            self.close()
+            raise RuntimeError(reply[1])
+
+    @property
+    def dropped(self):
+        return self._lost + self._counters[0]
+
+    # Hooks replayed when the child is restarted
+    _undo = {
+        "on_disable" : "on_enable",
+        "on_stop" : "on_start",
+        "on_resume" : "on_suspend",
+    }
+
+    def call(self, hook):
+        if self._failed:
+            return
+        if hook in self._undo:
+            if self._undo[hook] in self._hooks:
+                self._hooks.remove(self._undo[hook])
+        elif hook in self._undo.values():
+            self._hooks.append(hook)
+        self._control.send(("call", hook))
+
+    # Restart the child with a ring that fits records of dtype
+    def _respawn(self, dtype):
+        lost = self.dropped
+        self._shutdown()
+        self._spawn(max(self.ring_capacity,
+            ring.FrameRing.needed(dtype, self.slots)))
+        self._lost = lost
+        for hook in self._hooks:
+            self._control.send(("call", hook))
+
+    def post(self, data):
+        if self._failed:
+            self._lost += 1
+            return
+        frames = self._ring
+        dtype = data.record.dtype
+        if dtype != frames.dtype:
+            if ring.FrameRing.needed(dtype, self.slots) > frames.capacity:
+                log.Logger().debug("Frames of {0} don't fit the ring, "
+                    "restarting the output process".format(self._name))
+                try:
+                    self._respawn(dtype)
+                except RuntimeError as e:
+                    log.Logger().debug("Output {0} failed: {1}"\
+                        .format(self._name, str(e)))
+                    self._failed = True
+                    self._lost += 1
+                    return
+                frames = self._ring
+            self._generation += 1
+            frames.layout(dtype, self._generation, writer=True)
+            self._control.send(("layout", data.bins.keys(),
+                len(data.spectrum), self._generation))
+        frames.begin()[...] = data.record
+        frames.commit()
+
+    def close(self):
+        if not self._failed:
+            self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self._control.send(("close",))
+        except (IOError, OSError):
+            pass
+        self._process.join(2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._ring.close()
+        self._control.close()
+
+# Runs in the child of an OutputProcess
+def _host(modname, config, max_fps, frames, counters, timings, control):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        instance = importlib.import_module(modname).Output(config)
+    except Exception as e:
+        control.send(("error", "Could not create instance: {0}"\
+            .format(str(e))))
+        return
+    control.send(("ready",))
+
+    def call(hook):
+        try:
+            _timed_call(getattr(instance, hook), timings.get(hook))
+        except AttributeError:
+            pass
+        except Exception as e:
+            counters[1] += 1
+            log.Logger().debug("Output {0} failed: {1}"\
+                .format(hook, str(e)))
+
+    frame = analysis.Frame(0)
+    cap = RateCap(max_fps)
+    last = None
+    suspended = False
+    while True:
+        # Leave the ring alone while rate capped
+        wait = cap.wait(time.monotonic())
+        if wait:
+            (rlist, _, _) = select([control], [], [], wait)
+            ready = not rlist
+        else:
+            (rlist, _, _) = select([control, frames], [], [],
+                idle_interval if suspended else None)
+            ready = frames in rlist
+            if not rlist:
+                call("idle")
+                continue
+
+        if control in rlist:
+            try:
+                message = control.recv()
+            except EOFError:
+                return
+            if message[0] == "call":
+                if message[1] in ("on_suspend", "on_resume"):
+                    suspended = message[1] == "on_suspend"
+                call(message[1])
+            elif message[0] == "layout":
+                frame = analysis.Frame(message[2], message[1])
+                frames.layout(frame.record.dtype, message[3])
+            elif message[0] == "close":
+                return
+            continue
+
+        if ready:
+            seq = frames.read(frame.record)
+            counters[0] = frames.dropped
+            if seq == None:
+                continue
+            now = time.monotonic()
+            dt = now - last if last != None else 0.0
+            last = now
+            cap.take(now)
+            try:
+                _timed_call(instance.update, timings.get("update"),
+                    frame.load(seq), dt)
+            except Exception as e:
+                counters[1] += 1
+                log.Logger().debug("Output update failed: {0}"\
+                    .format(str(e)))
+
 class OutputInstance(object):
-    def __init__(self, output, name, config):
-        self.instance = output.module.Output(config)
+    def __init__(self, output, name, config, options):
+        # Hosted instances are created in their own process on enable
+        if options["worker"] == "process":
+            self.instance = None
+        else:
+            self.instance = output.module.Output(config)
         self.output = output
         self.name = name
+        self.config = config
+        self.options = options
+        # Hosted instances are timed in their own process
+        shared = options["worker"] == "process"
+        self.timings = {
+            "update" : Timing(shared),
+            "on_start" : Timing(shared),
+        }
         self._enabled = False
+        self._suspended = False
+        self._worker = None
+        self._cap = RateCap(options["max_fps"])
+        self._dt = 0.0
+        self._dropped = 0
+
+    # How the instance is run, inline, thread or process
+    @property
+    def mode(self):
+        return self.options["worker"]
+
+    # Frames not passed to the output, replaced in the mailbox of a
+    # worker or skipped by the rate cap
+    @property
+    def dropped(self):
+        if self._worker != None:
+            return self._dropped + self._worker.dropped
+        return self._dropped
 
     @property
     def enabled(self):
@@ -220,6 +846,24 @@ class OutputInstance(object):
     def enabled(self, value):
         if value == self._enabled:
             return
+        if not value:
+            self.suspended = False
+        if self.mode != "inline":
+            if value and self.mode == "process":
+                self._worker = OutputProcess(self.output, self.config,
+                    self.name, self.options["max_fps"], self.timings)
+                self._worker.call("on_enable")
+            elif value:
+                self._worker = OutputWorker(self.instance, self.name,
+                    self.options["max_fps"], self.timings)
+                self._worker.call("on_enable")
+            else:
+                self._worker.call("on_disable")
+                self._worker.close()
+                self._dropped += self._worker.dropped
+                self._worker = None
+            self._enabled = value
+            return
         self._enabled = value
         try:
             if value:
@@ -229,11 +873,79 @@ class OutputInstance(object):
         except AttributeError:
             pass
 
+    # Enabled instances not updated because they belong to a scene other
+    # than the current one are suspended.  Outputs owning a window can
+    # implement on_suspend() and on_resume() to hide and show it, and
+    # idle() to handle its events meanwhile.
+    @property
+    def suspended(self):
+        return self._suspended
+
+    @suspended.setter
+    def suspended(self, value):
+        if value == self._suspended:
+            return
+        self._suspended = value
+        self.call("on_suspend" if value else "on_resume")
+
+    # Call of idle() on a suspended instance running inline, the
+    # workers call it themselves
+    def idle(self):
+        fn = getattr(self.instance, "idle", None)
+        if fn != None:
+            fn()
+
+    # Call one of the on_* hooks of the output
+    def call(self, hook):
+        if self._worker != None:
+            self._worker.call(hook)
+            return
+        fn = getattr(self.instance, hook, None)
+        if fn != None:
+            _timed_call(fn, self.timings.get(hook))
+
+    # Frame skipped by the rate cap, outputs whose state is cleared
+    # every frame, such as DMX channels, can implement hold() to put
+    # back the state of their last update
+    def _hold(self):
+        fn = getattr(self.instance, "hold", None)
+        if fn != None:
+            fn()
+
+    def update(self, data, dt):
+        if self._worker != None:
+            self._worker.post(data)
+            return
+        self._dt += dt
+        if self._cap.interval:
+            now = time.monotonic()
+            if self._cap.wait(now):
+                self._dropped += 1
+                self._hold()
+                return
+            self._cap.take(now)
+        timing = self.timings["update"]
+        if timing.active:
+            _timed_call(self.instance.update, timing, data, self._dt)
+        else:
+            self.instance.update(data, self._dt)
+        self._dt = 0.0
+
 class Outputs(object):
     _outputs = {}
     _instances = {}
     _enabled = []
     _helpers = []
+    _plan = dict([(hook, []) for hook in helper_hooks + ("update", "idle")])
+    _scenes = {}
+    _scene = None
+    _running = False
+    _helper_timings = {}
+    _stats = False
+    _stats_since = 0.0
+    _deadline = 1.0 / 60
+    # Products derived from frames, shared between the outputs
+    derived = Derived()
 
     _instance = None
     def __new__(cls, *args, **kwargs):
@@ -250,6 +962,13 @@ class Outputs(object):
             c_output.add(CmdOutputDestroy())
             c_output.add(CmdOutputOnOff("enable"))
             c_output.add(CmdOutputOnOff("disable"))
+            c_output.add(CmdOutputStats())
+            c_scene = CmdBranch("scene")
+            c_output.add(c_scene)
+            c_scene.add(CmdSceneCreate())
+            c_scene.add(CmdSceneDestroy())
+            c_scene.add(CmdSceneSwitch())
+            c_scene.add(CmdSceneList())
             cls._update_ts = time.time()
         return cls._instance
 
@@ -257,11 +976,33 @@ class Outputs(object):
     def register_helper(self, helper):
         if helper not in self._helpers:
             self._helpers.append(helper)
+            timings = {
+                "before_update" : Timing(),
+                "after_update" : Timing(),
+            }
+            for timing in timings.values():
+                timing.active = self._stats
+                timing.deadline = self._deadline
+            self._helper_timings[helper] = timings
+            self._build_plan()
 
     # Register a new output module
     def register(self, module):
-        self._cmd_create.add(CmdOutputCreate(module))
-        self._outputs[module.alias] = OutputModule(module)
+        manifest = {}
+        for key in manifest_keys:
+            if hasattr(module, key):
+                manifest[key] = getattr(module, key)
+        self._add(OutputModule(manifest, lambda: module, module.__name__))
+
+    # Register an output module by its manifest, the module is imported
+    # by name when the first instance is created
+    def register_lazy(self, name, manifest):
+        self._add(OutputModule(manifest, lambda: importlib.import_module(name),
+            name))
+
+    def _add(self, output):
+        self._cmd_create.add(CmdOutputCreate(output))
+        self._outputs[output.alias] = output
 
     # Create an instance of a module
     def create(self, name, user_config={}):
@@ -270,6 +1011,9 @@ class Outputs(object):
 
         (result, instance) = self._outputs[name].create(user_config)
         if result:
+            for timing in instance.timings.values():
+                timing.active = self._stats
+                timing.deadline = self._deadline
             self._instances[instance.name] = instance
             return (result, instance.name)
         else:
@@ -282,18 +1026,61 @@ class Outputs(object):
         instance = self._instances[name]
         self.disable(name)
         del self._instances[name]
+        for scene in self._scenes.values():
+            if name in scene:
+                scene.remove(name)
         return instance.output.destroy(name)
 
-    def _update_enabled(self):
-        self._enabled = list(filter(lambda x: x.enabled, self.instances()))
+    # Precompute the calls made on start, stop and update.  The plan
+    # holds the bound hooks of the helpers that implement them, ordered
+    # by the helpers' depends attribute, and the enabled outputs ordered
+    # by their after option.  Rebuilt when outputs are enabled or
+    # disabled, helpers are registered and when timing is toggled.
+    def _build_plan(self):
+        helpers = _ordered(self._helpers,
+            lambda helper: getattr(helper, "depends", ()))
+        plan = {}
+        for hook in helper_hooks:
+            calls = []
+            for helper in helpers:
+                fn = getattr(helper, hook, None)
+                if fn == None:
+                    continue
+                timing = self._helper_timings[helper].get(hook)
+                if self._stats and timing != None:
+                    fn = functools.partial(_timed_call, fn, timing)
+                calls.append(fn)
+            plan[hook] = calls
+
+        instances = self._instances
+        self._enabled = _ordered(filter(lambda x: x.enabled, self.instances()),
+            lambda output: [instances[output.options["after"]]]
+                if output.options["after"] in instances else [])
+        # Outputs of scenes other than the current one are kept warm
+        # but not updated
+        standby = set()
+        for scene in self._scenes.values():
+            standby.update(scene)
+        standby.difference_update(self._scenes.get(self._scene, ()))
+        plan["update"] = [output.update for output in self._enabled
+            if output.name not in standby]
+        plan["idle"] = [output.idle for output in self._enabled
+            if output.name in standby and output.mode == "inline"]
+        self._plan = plan
+        for output in self._enabled:
+            output.suspended = output.name in standby
 
     # Enable module
     def enable(self, name):
         if name not in self._instances:
             return False
         instance = self._instances[name]
-        instance.enabled = True
-        self._update_enabled()
+        try:
+            instance.enabled = True
+        except Exception as e:
+            log.Logger().debug("Failed to enable {0}: {1}".format(name, str(e)))
+            return False
+        self._build_plan()
         return True
 
     # Disable module
@@ -302,9 +1089,76 @@ class Outputs(object):
             return False
         instance = self._instances[name]
         instance.enabled = False
-        self._update_enabled()
+        self._build_plan()
+        return True
+
+    # Enable instances that aren't yet, running them through on_start
+    # if the outputs have been started.  Returns the name of the
+    # instance that failed or None.
+    def _warm(self, names):
+        warm = list(filter(lambda x: not self._instances[x].enabled, names))
+        for name in warm:
+            if not self.enable(name):
+                return name
+            if self._running:
+                self._instances[name].call("on_start")
+        return None
+
+    # Create a scene of existing instances.  The instances are enabled
+    # right away but only updated while the scene is the current one,
+    # so switching scenes doesn't have to set up any outputs.
+    def create_scene(self, name, names):
+        if name in self._scenes:
+            return (False, "Scene already exists: {0}".format(name))
+        for instance in names:
+            if instance not in self._instances:
+                return (False, "No such output: {0}".format(instance))
+
+        self._scenes[name] = list(names)
+        failed = self._warm(names)
+        if failed != None:
+            self.destroy_scene(name)
+            return (False, "Failed to enable {0}".format(failed))
+        self._build_plan()
+        return (True, name)
+
+    # Destroy a scene, instances not part of any other scene are
+    # disabled
+    def destroy_scene(self, name):
+        if name not in self._scenes:
+            return False
+        names = self._scenes.pop(name)
+        if self._scene == name:
+            self._scene = None
+        others = set()
+        for scene in self._scenes.values():
+            others.update(scene)
+        for instance in names:
+            if instance not in others and instance in self._instances:
+                self.disable(instance)
+        self._build_plan()
+        return True
+
+    # Make name the current scene, takes effect from the next frame
+    def switch_scene(self, name):
+        if name not in self._scenes:
+            return False
+        if self._warm(self._scenes[name]) != None:
+            return False
+        self._scene = name
+        self._build_plan()
         return True
 
+    @property
+    def scene(self):
+        return self._scene
+
+    def scenes(self):
+        return sorted(self._scenes.keys())
+
+    def scene_instances(self, name):
+        return list(self._scenes[name])
+
     # Return list of available output modules
     def available(self):
         return map(lambda x: {
@@ -322,45 +1176,88 @@ class Outputs(object):
     def active(self):
         return sorted(self._enabled, key=lambda x: x.name)
 
+    def _all_timings(self):
+        for instance in self._instances.values():
+            for timing in instance.timings.values():
+                yield timing
+        for timings in self._helper_timings.values():
+            for timing in timings.values():
+                yield timing
+
+    # Collect call timings of outputs and helpers
+    @property
+    def stats(self):
+        return self._stats
+
+    @stats.setter
+    def stats(self, value):
+        if value and not self._stats:
+            self.reset_stats()
+        Outputs._stats = value
+        for timing in self._all_timings():
+            timing.active = value
+        self._build_plan()
+
+    def reset_stats(self):
+        Outputs._stats_since = time.monotonic()
+        for timing in self._all_timings():
+            timing.reset()
+
+    def stats_elapsed(self):
+        return time.monotonic() - self._stats_since
+
+    # Time budget of one frame in seconds, longer calls are counted
+    # as missed deadlines
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @deadline.setter
+    def deadline(self, value):
+        Outputs._deadline = value
+        for timing in self._all_timings():
+            timing.deadline = value
+
+    # Return a list of (name, call, timing, dropped) for all instances
+    # and helpers, dropped is None where not applicable
+    def timings(self):
+        result = []
+        for instance in self.instances():
+            for call in ("update", "on_start"):
+                result.append((instance.name, call, instance.timings[call],
+                    instance.dropped if call == "update" else None))
+        for helper in self._helpers:
+            timings = self._helper_timings[helper]
+            for call in ("before_update", "after_update"):
+                result.append((helper.__class__.__name__, call,
+                    timings[call], None))
+        return result
+
     # On start event
     def start(self):
-        for helper in self._helpers:
-            try:
-                helper.before_start()
-            except AttributeError:
-                pass
+        self._running = True
+        plan = self._plan
+        for fn in plan["before_start"]:
+            fn()
 
         for output in self._enabled:
-            try:
-                output.instance.on_start()
-            except AttributeError:
-                pass
+            output.call("on_start")
 
-        for helper in self._helpers:
-            try:
-                helper.after_start()
-            except AttributeError:
-                pass
+        for fn in plan["after_start"]:
+            fn()
 
     # On stop event
     def stop(self):
-        for helper in self._helpers:
-            try:
-                helper.before_stop()
-            except AttributeError:
-                pass
+        self._running = False
+        plan = self._plan
+        for fn in plan["before_stop"]:
+            fn()
 
         for output in self._enabled:
-            try:
-                output.instance.on_stop()
-            except AttributeError:
-                pass
+            output.call("on_stop")
 
-        for helper in self._helpers:
-            try:
-                helper.after_stop()
-            except AttributeError:
-                pass
+        for fn in plan["after_stop"]:
+            fn()
 
     # Update active outputs with new data
     def update(self, data):
@@ -368,17 +1265,15 @@ class Outputs(object):
         dt = now - self._update_ts
         self._update_ts = now
 
-        for helper in self._helpers:
-            try:
-                helper.before_update()
-            except AttributeError:
-                pass
+        plan = self._plan
+        for fn in plan["before_update"]:
+            fn()
 
-        for output in self._enabled:
-            output.instance.update(data, dt)
+        for fn in plan["update"]:
+            fn(data, dt)
 
-        for helper in self._helpers:
-            try:
-                helper.after_update()
-            except AttributeError:
-                pass
+        for fn in plan["idle"]:
+            fn()
+
+        for fn in plan["after_update"]:
+            fn()
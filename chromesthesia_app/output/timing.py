@@ -0,0 +1,108 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import math
+from multiprocessing import Array
+
+# Histogram of call durations.  Durations are counted in logarithmic
+# buckets, four per octave starting at 1 us, percentiles are reported
+# as the upper bound of their bucket.  Adding a call only costs a few
+# arithmetic operations.  A shared histogram lives in shared memory
+# and can be updated from an output process.
+class Timing(object):
+    buckets = 100
+
+    # Indices into the statistics array
+    _CALLS, _TOTAL, _MAX, _MISSED, _ACTIVE, _DEADLINE = range(0, 6)
+
+    def __init__(self, shared=False):
+        if shared:
+            self._counts = Array('l', self.buckets, lock=False)
+            self._stats = Array('d', 6, lock=False)
+        else:
+            self._counts = [0] * self.buckets
+            self._stats = [0.0] * 6
+
+    # Collect durations, only add() calls made while active are counted
+    @property
+    def active(self):
+        return self._stats[self._ACTIVE] != 0.0
+
+    @active.setter
+    def active(self, value):
+        self._stats[self._ACTIVE] = 1.0 if value else 0.0
+
+    # Calls taking longer than the deadline, in seconds, are missed
+    @property
+    def deadline(self):
+        return self._stats[self._DEADLINE]
+
+    @deadline.setter
+    def deadline(self, value):
+        self._stats[self._DEADLINE] = value
+
+    def reset(self):
+        for i in range(0, self.buckets):
+            self._counts[i] = 0
+        for i in (self._CALLS, self._TOTAL, self._MAX, self._MISSED):
+            self._stats[i] = 0.0
+
+    # Add the duration of one call in seconds
+    def add(self, duration):
+        stats = self._stats
+        stats[self._CALLS] += 1
+        stats[self._TOTAL] += duration
+        if duration > stats[self._MAX]:
+            stats[self._MAX] = duration
+        if duration > stats[self._DEADLINE] > 0.0:
+            stats[self._MISSED] += 1
+
+        bucket = 0
+        if duration > 1e-6:
+            (m, e) = math.frexp(duration * 1e6)
+            bucket = min(self.buckets - 1, (e - 1) * 4 + int((m - 0.5) * 8))
+        self._counts[bucket] += 1
+
+    # Upper bound of a bucket in seconds
+    def _bound(self, bucket):
+        (e, sub) = divmod(bucket, 4)
+        return (0.5 + (sub + 1) / 8.0) * 2 ** (e + 1) * 1e-6
+
+    def percentile(self, p):
+        calls = self._stats[self._CALLS]
+        if not calls:
+            return 0.0
+        target = calls * p / 100.0
+        count = 0
+        for bucket in range(0, self.buckets):
+            count += self._counts[bucket]
+            if count >= target:
+                return min(self._bound(bucket), self._stats[self._MAX])
+        return self._stats[self._MAX]
+
+    # Summary of the collected durations, elapsed is the collection
+    # time in seconds used for the call rate
+    def summary(self, elapsed):
+        stats = self._stats
+        calls = int(stats[self._CALLS])
+        return {
+            "calls" : calls,
+            "rate" : calls / elapsed if elapsed > 0 else 0.0,
+            "mean" : stats[self._TOTAL] / calls if calls else 0.0,
+            "p50" : self.percentile(50),
+            "p99" : self.percentile(99),
+            "max" : stats[self._MAX],
+            "missed" : int(stats[self._MISSED]),
+        }
@@ -0,0 +1,102 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import numpy as np
+
+# Supported capture formats as (bytes per sample, numpy type, scale).
+# Samples are scaled to the 16-bit integer range the analyzer
+# was tuned for, regardless of capture format.
+FORMATS = {
+    "int16" : (2, np.int16, 1.0),
+    "int24" : (3, np.int32, 1.0 / 65536),
+    "float32" : (4, np.float32, 32768.0),
+}
+
+# Decodes raw interleaved PCM buffers into numpy arrays without
+# going through Python objects.  Buffers are viewed in place with
+# np.frombuffer, channels are strided views into the interleaved
+# data and any conversion is done into preallocated arrays.
+class PCMDecoder(object):
+    def __init__(self, fmt, channels, frames):
+        if fmt not in FORMATS:
+            raise ValueError("Unsupported sample format: {0}".format(fmt))
+        if channels < 1:
+            raise ValueError("Invalid number of channels: {0}".format(channels))
+        (self.sample_size, self._dtype, self._scale) = FORMATS[fmt]
+        self.format = fmt
+        self.channels = channels
+        self._alloc(frames)
+
+    def _alloc(self, frames):
+        self._frames = frames
+        # 24-bit samples are widened to 32-bit by placing the three
+        # little endian bytes in the upper part of an int32.
+        if self.format == "int24":
+            self._wide = np.zeros((frames * self.channels, 4), dtype=np.uint8)
+        self._out = np.zeros(frames)
+
+    @property
+    def frame_size(self):
+        return self.sample_size * self.channels
+
+    # Return a (frames, channels) view of the samples in buf
+    def interleaved(self, buf):
+        frames = len(buf) // self.frame_size
+        if frames != self._frames:
+            self._alloc(frames)
+
+        if self.format == "int24":
+            raw = np.frombuffer(buf, dtype=np.uint8,
+                count=frames * self.frame_size).reshape(-1, 3)
+            self._wide[:, 1:] = raw
+            samples = self._wide.view(np.int32).reshape(-1)
+        else:
+            samples = np.frombuffer(buf, dtype=self._dtype,
+                count=frames * self.channels)
+        return samples.reshape(frames, self.channels)
+
+    # Return a strided view of one channel
+    def channel(self, buf, channel):
+        return self.interleaved(buf)[:, channel]
+
+    # Decode buf into mono samples in the 16-bit range.  For single
+    # channel 16-bit data the result is a read-only view of buf,
+    # otherwise it's a preallocated array reused on the next call.
+    def decode(self, buf):
+        samples = self.interleaved(buf)
+        if self.channels == 1:
+            samples = samples[:, 0]
+            if self._scale == 1.0:
+                return samples
+            return np.multiply(samples, self._scale, out=self._out)
+
+        out = self._out
+        np.sum(samples, axis=1, out=out)
+        np.multiply(out, self._scale / self.channels, out=out)
+        return out
+
+# Encode mono samples in the 16-bit range into raw interleaved PCM,
+# the inverse of PCMDecoder.decode.  Every channel gets the same data.
+def encode(samples, fmt, channels=1):
+    if fmt not in FORMATS:
+        raise ValueError("Unsupported sample format: {0}".format(fmt))
+    samples = np.repeat(np.asarray(samples, dtype=np.float64), channels)
+    if fmt == "int16":
+        return samples.clip(-32768, 32767).astype(np.int16).tobytes()
+    elif fmt == "float32":
+        return (samples / 32768.0).astype(np.float32).tobytes()
+
+    wide = (samples * 256).clip(-2**23, 2**23 - 1).astype(np.int32)
+    return wide.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
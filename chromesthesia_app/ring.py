@@ -0,0 +1,200 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import os
+import errno
+import ctypes
+import numpy as np
+from multiprocessing import RawArray
+from multiprocessing.reduction import DupFd
+
+# Doorbell that select() can wait on.  Uses an eventfd where available,
+# otherwise a non-blocking pipe.  The writer rings once per frame and
+# the reader clears all pending rings at once.
+class Doorbell(object):
+    def __init__(self):
+        if hasattr(os, "eventfd"):
+            fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._rfd, self._wfd = fd, fd
+            self._eventfd = True
+        else:
+            self._rfd, self._wfd = os.pipe()
+            os.set_blocking(self._rfd, False)
+            os.set_blocking(self._wfd, False)
+            self._eventfd = False
+
+    # Passed to a child being started by duplicating the descriptors
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_rfd"] = DupFd(self._rfd)
+        state["_wfd"] = DupFd(self._wfd) if self._wfd != self._rfd else None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rfd = state["_rfd"].detach()
+        self._wfd = self._rfd if state["_wfd"] == None else \
+            state["_wfd"].detach()
+
+    def fileno(self):
+        return self._rfd
+
+    def ring(self):
+        try:
+            if self._eventfd:
+                os.eventfd_write(self._wfd, 1)
+            else:
+                os.write(self._wfd, b"\0")
+        except OSError as e:
+            # Reader is behind, it will pick up the latest frame anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def clear(self):
+        try:
+            if self._eventfd:
+                os.eventfd_read(self._rfd)
+            else:
+                while os.read(self._rfd, 4096):
+                    pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        os.close(self._rfd)
+        if self._wfd != self._rfd:
+            os.close(self._wfd)
+
+# Single writer, single reader ring of fixed layout records in shared
+# memory.  Must be created before the other process is forked, or be
+# passed to it as an argument of the Process being started.
+#
+# Each slot carries the sequence number of the record it holds, the
+# slot sequence is cleared while the writer updates a slot so that a
+# reader can detect a torn read and retry with the newest record.
+#
+# The shared memory can be allocated larger than the records need, to
+# allow switching to another record layout later with layout().
+class FrameRing(object):
+    def __init__(self, dtype, size=8, capacity=0):
+        self.size = size
+        self.capacity = max(capacity, self.needed(dtype, size))
+        self._shm = RawArray(ctypes.c_uint8, 16 + 8 * size + self.capacity)
+        self._map()
+        self._doorbell = Doorbell()
+        self.dropped = 0
+        self._view(dtype, 0)
+
+    def _map(self):
+        self._head = np.frombuffer(self._shm, dtype=np.uint64, count=1)
+        self._gen = np.frombuffer(self._shm, dtype=np.uint64,
+            count=1, offset=8)
+        self._seq = np.frombuffer(self._shm, dtype=np.uint64,
+            count=self.size, offset=16)
+
+    # The views of the shared memory are made again on unpickling
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for key in ("_head", "_gen", "_seq", "_slots"):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+        self._slots = np.frombuffer(self._shm, dtype=self.dtype,
+            count=self.size, offset=16 + 8 * self.size)
+
+    # Bytes of record storage needed for a ring of records of dtype
+    @staticmethod
+    def needed(dtype, size=8):
+        return np.dtype(dtype).itemsize * size
+
+    def _view(self, dtype, generation):
+        self.dtype = np.dtype(dtype)
+        self.generation = generation
+        self._slots = np.frombuffer(self._shm, dtype=self.dtype,
+            count=self.size, offset=16 + 8 * self.size)
+        self._next = 1
+        self._last = 0
+
+    # Switch to records of another dtype, called by both sides.  The
+    # writer clears the ring before it publishes the new generation and
+    # the reader ignores the ring until then, so a record is never read
+    # with the wrong layout.  Raises ValueError if the records don't fit.
+    def layout(self, dtype, generation, writer=False):
+        if self.needed(dtype, self.size) > self.capacity:
+            raise ValueError("Record layout doesn't fit the ring")
+        self._view(dtype, generation)
+        if writer:
+            self._seq[:] = 0
+            self._head[0] = 0
+            self._gen[0] = generation
+
+    def fileno(self):
+        return self._doorbell.fileno()
+
+    def close(self):
+        self._doorbell.close()
+
+    # Writer side, returns the next slot as a 0-d array for in place
+    # update, fields can be assigned one by one or all at once
+    def begin(self):
+        index = self._next % self.size
+        self._seq[index] = 0
+        return self._slots[index, ...]
+
+    # Writer side, publish the slot returned by begin()
+    def commit(self):
+        seq = self._next
+        self._seq[seq % self.size] = seq
+        self._head[0] = seq
+        self._next = seq + 1
+        self._doorbell.ring()
+        return seq
+
+    # Reader side, copy a record into out.  With latest set the newest
+    # record is returned and any records in between are counted as
+    # dropped, otherwise the next record in sequence is returned if
+    # it's still available.  Returns the sequence number of the copied
+    # record or None if there is no new record.
+    def read(self, out, latest=True):
+        self._doorbell.clear()
+        if int(self._gen[0]) != self.generation:
+            return None
+        while True:
+            head = int(self._head[0])
+            if head <= self._last:
+                return None
+            if latest:
+                seq = head
+            else:
+                # Oldest slot not about to be reused by the writer
+                seq = max(self._last + 1, head - self.size + 2)
+
+            index = seq % self.size
+            out[...] = self._slots[index]
+            if int(self._gen[0]) != self.generation:
+                return None
+            if int(self._seq[index]) != seq:
+                continue
+
+            self.dropped += seq - self._last - 1
+            self._last = seq
+            if seq < head:
+                # More records pending, keep the doorbell ringing
+                self._doorbell.ring()
+            return seq
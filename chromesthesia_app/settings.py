@@ -23,12 +23,25 @@ def singleton(cls):
         return instances[cls]
     return getinstance
 
+# Settings are typed, a value is converted to the type of the setting
+# (by default the type of its initial value) and checked against the
+# allowed values or range before it's stored.  Keys sharing a callback
+# belong to the same subsystem, update() sets several keys at once and
+# calls every affected callback only once.
 @singleton
 class Settings(object):
     _settings = {}
+    _specs = {}
 
-    def create(self, key, value="", callback=None):
+    def create(self, key, value="", callback=None, type=None, values=None,
+               min=None, max=None):
         self._settings[key] = (value, callback)
+        self._specs[key] = {
+            "type" : type if type != None else value.__class__,
+            "values" : values,
+            "min" : min,
+            "max" : max,
+        }
 
     def __getitem__(self, key):
         if key in self._settings:
@@ -37,14 +50,73 @@ class Settings(object):
         else:
             raise AttributeError("No such setting " + key)
 
+    # Convert a value to the type of the setting and check it, returns
+    # the converted value.  Raises AttributeError for invalid values.
+    def check(self, key, val):
+        if key not in self._settings:
+            raise AttributeError("No such setting " + key)
+        spec = self._specs[key]
+        vtype = spec["type"]
+        try:
+            if vtype == int and isinstance(val, float) and \
+                    not val.is_integer():
+                raise ValueError
+            val = vtype(val)
+        except (TypeError, ValueError):
+            raise AttributeError("Expected a value of type {0}"\
+                .format(vtype.__name__))
+        if spec["values"] != None and val not in spec["values"]:
+            raise AttributeError("Value must be one of " +
+                ", ".join([str(v) for v in spec["values"]]))
+        if spec["min"] != None and val < spec["min"]:
+            raise AttributeError("Value must be at least {0}"\
+                .format(spec["min"]))
+        if spec["max"] != None and val > spec["max"]:
+            raise AttributeError("Value must be at most {0}"\
+                .format(spec["max"]))
+        return val
+
     def __setitem__(self, key, val):
-        if key in self._settings:
-            (_, callback) = self._settings[key]
+        self.update([(key, val)])
+
+    # Set several settings in one transaction.  All values are checked
+    # before anything is changed, then each callback of the changed
+    # keys is called once, with the last of its keys.  If a callback
+    # rejects the values with ValueError all keys are restored, the
+    # callbacks that already ran are called again with the old values
+    # and AttributeError is raised.
+    def update(self, values):
+        if isinstance(values, dict):
+            values = list(values.items())
+        values = [(key, self.check(key, val)) for (key, val) in values]
+
+        old = {}
+        calls = []
+        for (key, val) in values:
+            (prev, callback) = self._settings[key]
+            if prev == val and key not in old:
+                continue
+            old.setdefault(key, prev)
             self._settings[key] = (val, callback)
-            if callback != None:
-                callback(key, val)
-        else:
-            raise AttributeError("No such setting " + key)
+            if callback == None:
+                continue
+            calls = [c for c in calls if c[0] != callback]
+            calls.append((callback, key))
+
+        done = []
+        for (callback, key) in calls:
+            try:
+                callback(key, self[key])
+            except ValueError as e:
+                for k in old:
+                    self._settings[k] = (old[k], self._settings[k][1])
+                for (callback, key) in done:
+                    try:
+                        callback(key, self[key])
+                    except ValueError:
+                        pass
+                raise AttributeError(str(e))
+            done.append((callback, key))
 
 class CmdSet(Command):
     def __init__(self):
@@ -69,15 +141,30 @@ class CmdSet(Command):
 
             settings[key] = value
 
-        lines = []
+        # Check every value first, nothing is applied unless all are valid
+        errors = {}
         for setting in settings:
             try:
-                Settings()[setting] = settings[setting]
-                line = setting + " = " + str(settings[setting]) + ", ok"
-                lines = lines + [line]
+                Settings().check(setting, settings[setting])
+            except AttributeError as e:
+                errors[setting] = str(e)
+
+        if not errors:
+            try:
+                Settings().update(settings)
             except AttributeError as e:
-                line = setting + " = " + str(settings[setting]) + ", " + str(e)
-                lines = lines + [line]
+                errors = dict([(setting, str(e)) for setting in settings])
+
+        lines = []
+        for setting in settings:
+            if setting in errors:
+                status = errors[setting]
+            elif errors:
+                status = "not applied"
+            else:
+                status = "ok"
+            lines = lines + [setting + " = " + str(settings[setting]) +
+                ", " + status]
         return lines
 
 class CmdGet(Command):
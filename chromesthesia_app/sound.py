@@ -18,302 +18,485 @@ import os
 import signal
 import math
 import time
-import pyaudio
 import numpy as np
-from struct import unpack
-from multiprocessing import Process, Value, Pipe
+from multiprocessing import Process, Array, Pipe
 
 from command import Command
 import output
 import filter
-
+import spectrum
+import pcm
+import ring
+import analysis
+import bandbank
+import source
+import log
+
+# Live analyzer, runs the analysis pipeline on captured audio in a
+# separate process and publishes the frames through a shared ring.
+#
+# The analyzer process lives as long as the analyzer and is driven by
+# messages on a control pipe, it blocks on the pipe while stopped and
+# reacts to start, stop and parameter changes as soon as they are
+# sent.  Parameter changes are applied in place, the audio source is
+# only reopened when the capture parameters change and is paused, not
+# closed, while the analyzer is stopped.
 class SoundAnalyzer(object):
-
-    class Bin(object):
-        def __init__(self, fps):
-            self._fps = fps
-            self._level = 0
-            self._prevlevel = 0
-            self._avgflux = filter.RMA(fps * 2.5)
-            self._avgflux_rect = filter.RMA(fps * 2.5)
-            self._flux_thres = filter.MMF(fps * 5)
-            self._attack = False
-            self._in_transient = False
-            self._transient = 0.0
-            self._transient_period = filter.RMA(fps * 2)
-            self._transient_period.add(0.25)
-            self._ts = time.time()
-
-        @property
-        def level(self):
-            return self._level
-
-        @level.setter
-        def level(self, value):
-            now = time.time()
-            dt = now - self._ts
-            self._ts = now
-
-            self._prevlevel = self._level
-            # Approximated rolling average
-            self._level = (self._level / 2.0) + (value / 2.0)
-
-            # Update spectral flux value
-            flux = self._level - self._prevlevel
-            self._avgflux.add(abs(flux))
-
-            # Onset/transient calculation
-            in_attack = self._level >= self._prevlevel
-            onset = flux - self._avgflux_rect.value() >= self._flux_thres.value()
-
-            if not self._in_transient:
-                if onset:
-                    self._attack = True
-                    self._in_transient = True
-                    self._transient = 1.0
-                    self._onset_ts = now
-                    self._attack_vector = [self._level]
-                    self._transient_level = self._level
-            else:
-                x = 1.0 / (self._transient_period.value() / dt)
-                self._transient -= x
-
-                if self._attack:
-                    if not in_attack:
-                        self._transient_level = \
-                            np.mean(self._attack_vector) * 0.75
-                    else:
-                        self._attack_vector.append(self._level)
-                    self._attack = in_attack
-                else:
-                    if self._level < self._transient_level:
-                        if self._transient <= 0.0:
-                            self._transient = 0.0
-                            self._in_transient = False
-                            transient = min(1.0, now - self._onset_ts)
-                            self._transient_period.add(transient)
-                        self._transient /= 2
-
-                    if self._transient <= -4.0:
-                        self._transient = 0.0
-                        self._in_transient = False
-                        self._transient_period.add(self._transient_period.value())
-
-            self._avgflux_rect.add(max(0.0, flux))
-            if flux > 0:
-                self._flux_thres.add(flux)
-
-        @property
-        def flux(self):
-            return self._avgflux.value()
-
-        @property
-        def transient(self):
-            return max(0.0, self._transient)
-
-    def __init__(self, sample, fps):
-        self._fps = fps
-        chunk = int(sample / fps)
-
-        self._chunk = chunk
-        self._sample = sample
-        self._channels = 1
-        self._sample_width = 16
-
-        bins = []
-        freq = sample
-        # Split sample rate into bins with an exponential decay
-        # and 0-156 selected as the smallest band.  We calculate
-        # the mean power over these bins.
-        scale = 2
-        freq = freq / 2
-        while freq > 156:
-            prev_freq = freq
-            while True:
-                freq = freq / scale
-                # Pre-calculate offset into power array
-                prev_power_idx = scale * chunk * prev_freq / sample
-                power_idx = scale * chunk * freq / sample
-                if (prev_power_idx - power_idx) >= 1:
-                    break
-            bins.insert(0, [power_idx, prev_power_idx])
-
-        bins.insert(0, [0, (scale * chunk * freq / sample)])
-        self._bins = bins
-
-        # Calculate EQ weights
-        # Range from 2^0 to 2^6 (64) stretched over the number of bins
-        self._eq = np.power(2, np.linspace(0, 6, len(self._bins)))
-
-        self._running = Value('i', 0)
-        self._pipe, pipe = Pipe(duplex=False)
-
-        self._p = Process(target=self._run, args=(self._running, pipe))
+    # Supported capture formats
+    formats = ("int16", "int24", "float32")
+
+    # Most chunks analyzed as one batch when catching up
+    max_batch = 32
+
+    # Shared memory reserved for the frame ring, frame layouts up to
+    # this size can be switched to without a new analyzer process
+    ring_capacity = 256 * 1024
+
+    # Parameters that require the audio source to be reopened
+    _capture = ("sample", "fps", "format", "channels", "source")
+
+    def __init__(self, sample, fps, fmt="int16", channels=1, src="pyaudio",
+                 fftsize=0, window="rect", bands=3):
+        self._params = {
+            "sample" : sample,
+            "fps" : fps,
+            "format" : fmt,
+            "channels" : channels,
+            "source" : src,
+            "fftsize" : fftsize,
+            "window" : window,
+            "bands" : bands,
+        }
+        pipeline = self._check(self._params)
+
+        self._started = False
+        self._start_time = None
+        # Seconds from the last start() to the first frame read
+        self.start_latency = None
+        # Capture overflows, underflows, errors and backlog depth,
+        # updated by the analyzer
+        self._counters = Array('l', 4, lock=False)
+        self._generation = 0
+        self._spawn(pipeline)
+
+    # Validate a set of parameters, returns the pipeline they describe
+    def _check(self, params):
+        # Validates the source spec
+        source.parse(params["source"])
+        if params["format"] not in self.formats:
+            raise ValueError("Unsupported sample format: {0}"\
+                .format(params["format"]))
+        channels = params["channels"]
+        if not isinstance(channels, int) or channels < 1:
+            raise ValueError("Invalid number of channels: {0}".format(channels))
+
+        # Validates the STFT and band parameters
+        return Pipeline(params["sample"], params["fps"], params["fftsize"],
+            params["window"], params["bands"])
+
+    def _spawn(self, pipeline):
+        self._frame = analysis.Frame(pipeline.nspectrum, pipeline.names)
+        self._ring = ring.FrameRing(self._frame.record.dtype,
+            capacity=self.ring_capacity)
+        (control, self._control) = Pipe(duplex=False)
+
+        self._p = Process(target=self._run,
+            args=(self._ring, control, self._started))
         self._p.daemon = True
         self._p.start()
-        pipe.close()
+        control.close()
+
+    def _shutdown(self):
+        try:
+            self._control.send(("close",))
+        except (IOError, OSError):
+            pass
+        self._p.join(1.0)
+        if self._p.is_alive():
+            self._p.terminate()
+            self._p.join()
+        self._ring.close()
+        self._control.close()
 
     def close(self):
-        self._running.value = -1
-        self._p.terminate()
-        self._p.join()
-
+        self._shutdown()
+
+    # Change analyzer parameters, takes the same parameters as the
+    # constructor under the names sample, fps, format, channels,
+    # source, fftsize, window and bands.  Raises ValueError and keeps
+    # the current parameters if the new ones are invalid.
+    def configure(self, **params):
+        for key in params:
+            if key not in self._params:
+                raise ValueError("No such analyzer parameter: {0}".format(key))
+        new = dict(self._params)
+        new.update(params)
+        pipeline = self._check(new)
+        self._params = new
+
+        frame = analysis.Frame(pipeline.nspectrum, pipeline.names)
+        self._generation += 1
+        try:
+            self._ring.layout(frame.record.dtype, self._generation)
+        except ValueError:
+            # Frames too large for the ring, start a new analyzer
+            # process with a ring that fits
+            self._shutdown()
+            self._spawn(pipeline)
+            return
+        self._frame = frame
+        self._control.send(("config", new, self._generation))
+
+    # Number of frames produced by the analyzer but never read
+    @property
+    def dropped(self):
+        return self._ring.dropped
+
+    # Capture counters of the current source
+    @property
+    def overflows(self):
+        return self._counters[0]
+
+    @property
+    def underflows(self):
+        return self._counters[1]
+
+    @property
+    def errors(self):
+        return self._counters[2]
+
+    # Number of captured chunks that were waiting to be analyzed
+    # when the analyzer last read from the source
+    @property
+    def backlog(self):
+        return self._counters[3]
+
+    # Start analyzing, frames from before the start are never returned
+    # by data().  The ring is switched to a new generation that the
+    # analyzer publishes once it has started.
     def start(self):
-        self._running.value = 1
+        self._started = True
+        self._generation += 1
+        self._ring.layout(self._ring.dtype, self._generation)
+        self._start_time = time.monotonic()
+        self._control.send(("start", self._generation))
 
     def stop(self):
-        self._running.value = 0
+        self._started = False
+        self._start_time = None
+        self._control.send(("stop",))
 
     def fileno(self):
-        return self._pipe.fileno()
+        return self._ring.fileno()
 
-    def _run(self, running, pipe):
-        self._pipe.close()
-        self._pipe = pipe
+    # The methods below run in the analyzer process
+
+    def _run(self, ring, control, running):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        while running.value >= 0:
-            if running.value == 1:
-                self._analyze(running, pipe)
+        self._input = None
+        self._opened = False
+        self._running = running
+        self._closed = False
+        self._setup()
+        while not self._closed:
+            if self._running:
+                self._analyze(ring, control)
             else:
-                time.sleep(0.1)
-
-    def _analyze(self, running, pipe):
-        pa = pyaudio.PyAudio()
-        sample_fmt = pa.get_format_from_width(self._sample_width / 8)
-        input = pa.open(format=sample_fmt, input=True,
-            channels=self._channels, rate=self._sample,
-            frames_per_buffer=self._chunk)
-
-        sample_size = self._sample_width / 8
-        frame_len = self._chunk * sample_size * self._channels
-
-        if sample_size == 1:
-            data_type = 'b'
-            unpack_fmt = "%db" % int(frame_len)
-        elif sample_size == 2:
-            data_type = 'h'
-            unpack_fmt = "%dh" % int(frame_len / 2)
-
-        spectrum = [0] * len(self._bins)
-
-        bin_per_band = (len(self._bins) - 1) / 2
-        bass_e = 1
-        mid_e = bass_e + bin_per_band
+                self._command(control.recv(), ring)
+        self._close_source()
+
+    # Handle one message from the control pipe
+    def _command(self, message, ring):
+        if message[0] == "start":
+            self._running = True
+            self._layout(ring, message[1])
+        elif message[0] == "stop":
+            self._running = False
+        elif message[0] == "config":
+            self._reconfigure(message[1], message[2], ring)
+        elif message[0] == "close":
+            self._running = False
+            self._closed = True
+
+    # Clear the ring and publish a new generation of it
+    def _layout(self, ring, generation):
+        pipeline = self._pipeline
+        ring.layout(analysis.dtype(len(pipeline.names), pipeline.nspectrum),
+            generation, writer=True)
+
+    # Build the analysis state for the current parameters
+    def _setup(self):
+        params = self._params
+        chunk = int(params["sample"] / params["fps"])
+        self._chunk = chunk
+        self._decoder = pcm.PCMDecoder(params["format"], params["channels"],
+            chunk)
+        self._pipeline = Pipeline(params["sample"], params["fps"],
+            params["fftsize"], params["window"], params["bands"])
+        self._batch = np.zeros((self.max_batch, chunk))
+        self._times = [0.0] * self.max_batch
+
+    # Apply parameters sent by configure()
+    def _reconfigure(self, params, generation, ring):
+        reopen = [key for key in self._capture
+            if params[key] != self._params[key]]
+        self._params = params
+        if reopen:
+            self._close_source()
+        self._setup()
+        self._layout(ring, generation)
+
+    def _analyze(self, ring, control):
+        counters = self._counters
+        if self._opened:
+            self._resume_source()
+        self._pipeline.restart()
+
+        # Back off exponentially while the source keeps failing,
+        # reopening it before every retry.
+        backoff = 0.0
+        while self._running:
+            while control.poll():
+                self._command(control.recv(), ring)
+            if not self._running:
+                break
+
+            pipeline = self._pipeline
+            batch = self._batch
+            times = self._times
+            try:
+                if self._input == None:
+                    params = self._params
+                    self._input = source.create(params["source"],
+                        params["sample"], params["format"],
+                        params["channels"], self._chunk)
+                input = self._input
+                if not self._opened:
+                    input.open()
+                    self._opened = True
+                (frame, ts) = input.read()
+                batch[0] = self._decoder.decode(frame)
+                times[0] = ts
+
+                # Collect the chunks that are already waiting and
+                # analyze them together to catch up at once
+                backlog = input.pending()
+                counters[3] = backlog
+                n = 1
+                while n <= backlog and n < self.max_batch:
+                    (frame, times[n]) = input.read()
+                    batch[n] = self._decoder.decode(frame)
+                    n += 1
+                backoff = 0.0
+            except EOFError:
+                # Source is exhausted, idle until stopped or reconfigured
+                self._close_source()
+                control.poll(None)
+                continue
+            except Exception as e:
+                counters[2] += 1
+                backoff = min(1.0, max(0.01, backoff * 2))
+                log.Logger().debug("Audio source failed, retry in "\
+                    "{0:.2f}s: {1}".format(backoff, str(e)))
+                self._close_source()
+                control.poll(backoff)
+                continue
+            finally:
+                if self._input != None:
+                    counters[0] = self._input.overflows
+                    counters[1] = self._input.underflows
+
+            if n == 1:
+                pipeline.process(batch[0], times[0], ring.begin())
+                ring.commit()
+                continue
 
-        bass = SoundAnalyzer.Bin(self._fps)
-        mid = SoundAnalyzer.Bin(self._fps)
-        tre = SoundAnalyzer.Bin(self._fps)
+            bands = pipeline.spectra(batch[:n])
+            for i in range(0, n):
+                pipeline.track(bands[i], times[i], ring.begin())
+                ring.commit()
 
-        silence_thres = 0.05
+        if self._opened:
+            self._pause_source()
 
-        scale_avg = filter.RMA(self._fps * 30)
-        scale_avg.add(1)
-        scale_raw = 1
-        scale = scale_raw
-        scale_lock = None
+    def _pause_source(self):
+        try:
+            self._input.pause()
+        except Exception:
+            self._close_source()
 
-        avg_loudness = 0
-        prev_loudness_diff = 0
-        loudness_ack = 0
+    def _resume_source(self):
+        try:
+            self._input.resume()
+        except Exception:
+            self._close_source()
 
-        start = time.time()
-        while running.value == 1:
+    def _close_source(self):
+        if self._input != None:
             try:
-                frame = input.read(self._chunk)
-            except:
-                continue
-
-            cur = time.time()
-            dt = cur - start
-            start = cur
-
-            # Convert raw to numpy array
-            frame = unpack(unpack_fmt, frame)
-            frame = np.array(frame, dtype=data_type)
-
-            # Run numpy real FFT
-            fourier = np.fft.rfft(frame)
-            power = np.abs(fourier)
-
-            i = 0
-            for bin in self._bins:
-                s,e = bin
-                spectrum[i] = np.mean(power[s:e])
-                i = i + 1
-
-            spectrum = np.multiply(spectrum, self._eq)
-            spectrum = np.divide(spectrum, scale)
-            spectrum = spectrum.clip(0.0, 1.0)
-
-            bass.level = np.mean(spectrum[0:bass_e])
-            mid.level = np.mean(spectrum[bass_e:mid_e])
-            tre.level = np.mean(spectrum[mid_e:])
-
-            silence = bass.level <= silence_thres and \
-                mid.level <= silence_thres and \
-                tre.level <= silence_thres
-
-            loudness = (bass.level + mid.level +  tre.level) / 3
-            avg_loudness = (0.75 * avg_loudness) + (1.0 - 0.75) * loudness
-
-            # Calculate the scaling factor with a PID-based algorithm with
-            # an approximated moving average of 0.25 as target loudness level.
-            # The purpose of this is to have a rapid increase of the scaling
-            # factor to a useful value but then to keep it at a stable value
-            # versus the flux of the input loudness.
-            if not silence:
-                diff = avg_loudness - 0.25
-                loudness_ack = loudness_ack + (diff * dt)
-                loudness_d = (diff - prev_loudness_diff) / dt
-                output = 0.5*diff + 0.001*loudness_ack + 0.0001*loudness_d
-                prev_loudness_diff = diff
-                factor = 1 + output
-
-                scale_raw = scale * factor
-
-                # Don't update the scale value at "small enough" diffs
-                if abs(diff) <= 0.1:
-                    scale_lock = True
-                # Use a RMA average filter as scaling for
-                # "almost small" enough values.
-                elif abs(diff) <= 0.25:
-                    scale_lock = False
-                # Otherwise use raw scale factor directly from PID
-                else:
-                    scale_lock = None
-
-                if scale_lock == False:
-                    scale_avg.add(scale_raw)
-                    scale = scale_avg.value()
-                elif scale_lock == None:
-                    scale_avg.add(scale_raw)
-                    scale = scale_raw
-
-            pipe.send({"bins" : {
-                    "bass" : {
-                        "level" : bass.level,
-                        "flux" : bass.flux,
-                        "transient" : bass.transient
-                    },
-                    "mid" : {
-                        "level" : mid.level,
-                        "flux" : mid.flux,
-                        "transient" : mid.transient
-                    },
-                    "tre" : {
-                        "level" : tre.level,
-                        "flux" : tre.flux,
-                        "transient" : tre.transient
-                    },
-                }, "silence": silence, "spectrum" : spectrum})
-
-        input.stop_stream()
-        input.close()
-        pa.terminate()
-
+                self._input.close()
+            except Exception:
+                pass
+        self._input = None
+        self._opened = False
+
+    # Return the newest analysis frame, or the next one in sequence
+    # if drop is False.  Returns None if no new frame is available.
+    # The returned analysis.Frame is reused for every call.
     def data(self, drop=True):
-        data = self._pipe.recv()
-        while drop and self._pipe.poll():
-            data = self._pipe.recv()
-        return data
+        frame = self._frame
+        seq = self._ring.read(frame.record, latest=drop)
+        if seq is None:
+            return None
+        if self._start_time != None:
+            self.start_latency = time.monotonic() - self._start_time
+            self._start_time = None
+        return frame.load(seq)
+
+# The analysis pipeline, turns chunks of mono samples into analysis
+# frames.  Shared by the live SoundAnalyzer and offline analysis.
+#
+# Every chunk of sample / fps samples is one hop of a streaming STFT
+# over fftsize samples, fftsize 0 uses a window of one chunk.
+#
+# With 3 bands the spectrum is split into the classic bass, mid and
+# tre bands.  With more bands the spectrum gets one logarithmically
+# spaced bin per band, tracked as band0..bandN in addition to bass,
+# mid and tre which are then grouped by frequency.
+class Pipeline(object):
+    def __init__(self, sample, fps, fftsize=0, window="rect", bands=3):
+        if not isinstance(bands, int) or bands < 3:
+            raise ValueError("Invalid number of bands: {0}".format(bands))
+        self._fps = fps
+        self.chunk = int(sample / fps)
+        if not fftsize:
+            fftsize = self.chunk
+        self._stft = spectrum.STFT(fftsize, self.chunk, window)
+
+        if bands == 3:
+            self._bins = spectrum.band_layout(sample, fftsize)
+            bin_per_band = (len(self._bins) - 1) // 2
+            bass_e = 1
+            mid_e = bass_e + bin_per_band
+        else:
+            self._bins = spectrum.log_layout(sample, fftsize, bands)
+            top = [float(e) * sample / fftsize for (_, e) in self._bins]
+            bass_e = len([f for f in top if f <= 150])
+            mid_e = len([f for f in top if f <= 2500])
+            bass_e = min(max(bass_e, 1), bands - 2)
+            mid_e = min(max(mid_e, bass_e + 1), bands - 1)
+
+        nbins = len(self._bins)
+        groups = [[0, bass_e], [bass_e, mid_e], [mid_e, nbins]]
+        self.names = list(analysis.BANDS)
+        if bands > 3:
+            groups += [[i, i + 1] for i in range(0, nbins)]
+            self.names += ["band{0}".format(i) for i in range(0, nbins)]
+
+        # Calculate EQ weights
+        # Range from 2^0 to 2^6 (64) stretched over the number of bins
+        eq = np.power(2, np.linspace(0, 6, len(self._bins)))
+
+        # Band pooling is set up once, the per-frame work is done
+        # in place on the preallocated arrays of the pool.
+        self._pool = spectrum.BandPool(self._bins, fftsize // 2 + 1, eq)
+        self._groups = spectrum.BandPool(groups, nbins)
+        self.bank = bandbank.BandBank(fps, len(groups))
+
+        self._silence_thres = 0.05
+
+        self._scale_avg = filter.RMA(fps * 30)
+        self._scale_avg.add(1)
+        self._scale = 1
+        self._scale_lock = None
+
+        self._avg_loudness = 0
+        self._prev_loudness_diff = 0
+        self._loudness_ack = 0
+        self._ts = None
+
+    @property
+    def nspectrum(self):
+        return len(self._bins)
+
+    # Forget the time of the last chunk, used when capture has been
+    # paused so the gap isn't taken as one long frame
+    def restart(self):
+        self._ts = None
+
+    # Analyze one chunk of samples captured at time now (in seconds)
+    # and store the result in the analysis record out.
+    def process(self, samples, now, out):
+        power = self._stft.process(samples)
+        return self.track(self._pool.pool(power, self._scale), now, out)
+
+    # Band spectra of several consecutive chunks, one row of samples
+    # per chunk, computed with one batched FFT.  All rows are scaled
+    # with the current auto-gain scale.  Every row must then be passed
+    # to track() in order.
+    def spectra(self, samples):
+        power = self._stft.process_many(samples)
+        return self._pool.pool_many(power, self._scale)
+
+    # Track levels, onsets and auto-gain for the band spectrum of the
+    # chunk captured at time now and store the result in out.
+    def track(self, bands, now, out):
+        if self._ts is None or now <= self._ts:
+            dt = 1.0 / self._fps
+        else:
+            dt = now - self._ts
+        self._ts = now
+
+        bank = self.bank
+        bank.update(self._groups.pool(bands), now, dt)
+
+        # bass, mid and tre are always the first three bands
+        silence = bank.level[0] <= self._silence_thres and \
+            bank.level[1] <= self._silence_thres and \
+            bank.level[2] <= self._silence_thres
+
+        loudness = (bank.level[0] + bank.level[1] + bank.level[2]) / 3
+        self._avg_loudness = (0.75 * self._avg_loudness) + \
+            (1.0 - 0.75) * loudness
+
+        # Calculate the scaling factor with a PID-based algorithm with
+        # an approximated moving average of 0.25 as target loudness level.
+        # The purpose of this is to have a rapid increase of the scaling
+        # factor to a useful value but then to keep it at a stable value
+        # versus the flux of the input loudness.
+        if not silence:
+            diff = self._avg_loudness - 0.25
+            self._loudness_ack = self._loudness_ack + (diff * dt)
+            loudness_d = (diff - self._prev_loudness_diff) / dt
+            output = 0.5*diff + 0.001*self._loudness_ack + 0.0001*loudness_d
+            self._prev_loudness_diff = diff
+            factor = 1 + output
+
+            scale_raw = self._scale * factor
+
+            # Don't update the scale value at "small enough" diffs
+            if abs(diff) <= 0.1:
+                self._scale_lock = True
+            # Use a RMA average filter as scaling for
+            # "almost small" enough values.
+            elif abs(diff) <= 0.25:
+                self._scale_lock = False
+            # Otherwise use raw scale factor directly from PID
+            else:
+                self._scale_lock = None
+
+            if self._scale_lock == False:
+                self._scale_avg.add(scale_raw)
+                self._scale = self._scale_avg.value()
+            elif self._scale_lock == None:
+                self._scale_avg.add(scale_raw)
+                self._scale = scale_raw
+
+        out["timestamp"] = now
+        out["silence"] = silence
+        out["level"] = bank.level
+        out["flux"] = bank.flux
+        out["transient"] = bank.transient
+        out["spectrum"] = bands
+        return out
@@ -0,0 +1,422 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+# Audio source backends.  A source is selected with a spec on the
+# format name[:key=value[,key=value...]], for example
+#
+#   pyaudio                  Default capture device
+#   pipe:path=/tmp/fifo      Raw PCM from a FIFO
+#   synth:wave=click,bpm=128 Synthetic click track
+#
+# Every source delivers raw interleaved PCM in the configured sample
+# format, one chunk per read(), together with the capture time of the
+# last sample in the chunk.
+#
+# Options without a default are required.
+
+import os
+import time
+import fcntl
+import struct
+import termios
+import threading
+import numpy as np
+
+import pcm
+
+# Base of the source backends.  A backend implements read(), which
+# reads one chunk of raw PCM and returns (data, timestamp) with the
+# timestamp in seconds since the epoch, raising EOFError at end of
+# stream and IOError if the device fails.
+class Source(object):
+    options = {}
+
+    def __init__(self, sample, fmt, channels, chunk, options):
+        self.sample = sample
+        self.format = fmt
+        self.channels = channels
+        self.chunk = chunk
+        self.frame_size = pcm.FORMATS[fmt][0] * channels
+        self.overflows = 0
+        self.underflows = 0
+
+    def open(self):
+        pass
+
+    # Number of chunks that can be read right away, lets the analyzer
+    # detect that it has fallen behind the source
+    def pending(self):
+        return 0
+
+    # Stop and restart delivery without closing the source, data
+    # arriving while paused is discarded where the backend allows it
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def close(self):
+        pass
+
+# Single producer, single consumer queue of preallocated capture
+# buffers, filled from the PortAudio callback thread.  The producer
+# only moves head and the consumer only moves tail, so no lock is
+# needed, a semaphore wakes up the consumer.  The buffer last returned
+# to the consumer stays in the queue until the next get(), so the
+# producer can't overwrite it while it's being decoded.
+class CaptureQueue(object):
+    def __init__(self, size, length):
+        self._bufs = [bytearray(length) for i in range(0, size)]
+        self._ts = [0.0] * size
+        self._size = size
+        self._head = 0
+        self._tail = 0
+        self._held = 0
+        self._sem = threading.Semaphore(0)
+
+    # Producer side, returns False if the queue is full
+    def put(self, data, timestamp):
+        head = self._head
+        if head - self._tail >= self._size:
+            return False
+        index = head % self._size
+        self._bufs[index][:] = data
+        self._ts[index] = timestamp
+        self._head = head + 1
+        self._sem.release()
+        return True
+
+    # Consumer side, returns (buffer, timestamp) or None on timeout.
+    # The buffer is valid until the next call.
+    def get(self, timeout=None):
+        # Done with the previous buffer, hand it back to the producer
+        self._tail += self._held
+        self._held = 0
+        if not self._sem.acquire(timeout=timeout):
+            return None
+        index = self._tail % self._size
+        self._held = 1
+        return (self._bufs[index], self._ts[index])
+
+    def pending(self):
+        return self._head - self._tail - self._held
+
+# The PortAudio host is initialized once per process and kept for the
+# lifetime of the process, only streams are opened and closed.
+_pa = None
+
+def _pyaudio():
+    global _pa
+    if _pa == None:
+        import pyaudio
+        _pa = pyaudio.PyAudio()
+    return _pa
+
+class PyAudioSource(Source):
+    options = {
+        "device" : {
+            "type" : int,
+            "default" : None,
+            "min" : 0,
+            "help" : "Input device index, default device if not set"
+        },
+        "mode" : {
+            "type" : str,
+            "default" : "callback",
+            "values" : ["callback", "blocking"],
+            "help" : "Capture with a stream callback or blocking reads"
+        },
+        "queue" : {
+            "type" : int,
+            "default" : 8,
+            "min" : 2,
+            "help" : "Number of buffers queued in callback mode"
+        },
+    }
+
+    def __init__(self, sample, fmt, channels, chunk, options):
+        super(PyAudioSource, self).__init__(sample, fmt, channels, chunk, options)
+        self._device = options["device"]
+        self._callback_mode = options["mode"] == "callback"
+        self._queue_size = max(2, options["queue"])
+        self._input = None
+
+    def open(self):
+        import pyaudio
+        pa_format = {
+            "int16" : pyaudio.paInt16,
+            "int24" : pyaudio.paInt24,
+            "float32" : pyaudio.paFloat32,
+        }[self.format]
+        self._continue = pyaudio.paContinue
+        self._overflow = pyaudio.paInputOverflow
+        self._underflow = pyaudio.paInputUnderflow
+
+        pa = _pyaudio()
+        if self._callback_mode:
+            self._queue = CaptureQueue(self._queue_size,
+                self.chunk * self.frame_size)
+            self._input = pa.open(format=pa_format, input=True,
+                channels=self.channels, rate=self.sample,
+                input_device_index=self._device,
+                frames_per_buffer=self.chunk,
+                stream_callback=self._callback,
+                start=False)
+            # Offset from the PortAudio stream clock to wall clock time
+            self._offset = time.time() - self._input.get_time()
+            self._input.start_stream()
+        else:
+            self._input = pa.open(format=pa_format, input=True,
+                channels=self.channels, rate=self.sample,
+                input_device_index=self._device,
+                frames_per_buffer=self.chunk)
+
+    # Called from the PortAudio thread
+    def _callback(self, data, frames, time_info, status):
+        if status & self._overflow:
+            self.overflows += 1
+        if status & self._underflow:
+            self.underflows += 1
+
+        adc = time_info["input_buffer_adc_time"]
+        if adc <= 0:
+            adc = time_info["current_time"] - float(frames) / self.sample
+        if adc > 0:
+            timestamp = self._offset + adc + float(frames) / self.sample
+        else:
+            timestamp = time.time()
+
+        # Analyzer not keeping up, count as an overflow
+        if not self._queue.put(data, timestamp):
+            self.overflows += 1
+        return (None, self._continue)
+
+    def read(self):
+        if not self._callback_mode:
+            return (self._input.read(self.chunk, exception_on_overflow=False),
+                time.time())
+
+        # Allow a few buffer periods before the device is considered stalled
+        timeout = max(0.5, 4.0 * self.chunk / self.sample)
+        result = self._queue.get(timeout)
+        if result == None:
+            raise IOError("Capture device stalled")
+        return result
+
+    def pending(self):
+        if self._callback_mode:
+            return self._queue.pending()
+        return self._input.get_read_available() // self.chunk
+
+    def pause(self):
+        self._input.stop_stream()
+
+    def resume(self):
+        if self._callback_mode:
+            self._queue = CaptureQueue(self._queue_size,
+                self.chunk * self.frame_size)
+            self._offset = time.time() - self._input.get_time()
+        self._input.start_stream()
+
+    def close(self):
+        if self._input != None:
+            self._input.stop_stream()
+            self._input.close()
+            self._input = None
+
+# Raw PCM from a FIFO, for example fed by arecord or ffmpeg.  stdin
+# isn't supported as the console reads it.
+class PipeSource(Source):
+    options = {
+        "path" : {
+            "type" : str,
+            "help" : "FIFO to read from"
+        }
+    }
+
+    def __init__(self, sample, fmt, channels, chunk, options):
+        super(PipeSource, self).__init__(sample, fmt, channels, chunk, options)
+        self._path = options["path"]
+        self._fd = None
+        self._buf = bytearray(self.chunk * self.frame_size)
+
+    def open(self):
+        self._fd = os.open(self._path, os.O_RDONLY)
+
+    def read(self):
+        view = memoryview(self._buf)
+        pos = 0
+        while pos < len(view):
+            n = os.readv(self._fd, [view[pos:]])
+            if n == 0:
+                raise EOFError("End of stream")
+            pos += n
+        return (self._buf, time.time())
+
+    def pending(self):
+        try:
+            available = struct.unpack("i", fcntl.ioctl(self._fd,
+                termios.FIONREAD, b"\0\0\0\0"))[0]
+        except (IOError, OSError):
+            return 0
+        return available // len(self._buf)
+
+    def close(self):
+        if self._fd != None:
+            os.close(self._fd)
+            self._fd = None
+
+# Deterministic synthetic signals for running without audio hardware.
+# Output is paced to the sample rate unless realtime is 0.
+class SynthSource(Source):
+    options = {
+        "wave" : {
+            "type" : str,
+            "default" : "tone",
+            "values" : ["tone", "noise", "click"],
+            "help" : "Signal to generate"
+        },
+        "freq" : {
+            "type" : float,
+            "default" : None,
+            "min" : 0.0,
+            "help" : "Tone frequency, default 440 for tone and 100 for click"
+        },
+        "bpm" : {
+            "type" : float,
+            "default" : 120.0,
+            "min" : 1.0,
+            "max" : 1000.0,
+            "help" : "Click track tempo"
+        },
+        "level" : {
+            "type" : float,
+            "default" : 0.5,
+            "min" : 0.0,
+            "max" : 1.0,
+            "help" : "Signal level, 1.0 is full scale"
+        },
+        "seed" : {
+            "type" : int,
+            "default" : 0,
+            "min" : 0,
+            "max" : 2**32 - 1,
+            "help" : "Noise generator seed"
+        },
+        "realtime" : {
+            "type" : int,
+            "default" : 1,
+            "values" : [0, 1],
+            "help" : "Pace output to the sample rate"
+        },
+    }
+
+    def __init__(self, sample, fmt, channels, chunk, options):
+        super(SynthSource, self).__init__(sample, fmt, channels, chunk, options)
+        self._wave = options["wave"]
+        self._freq = options["freq"]
+        if self._freq == None:
+            self._freq = 100.0 if self._wave == "click" else 440.0
+        self._period = 60.0 / options["bpm"]
+        self._amplitude = options["level"] * 32767
+        self._seed = options["seed"]
+        self._realtime = options["realtime"]
+        self._index = np.arange(chunk)
+
+    def open(self):
+        self._pos = 0
+        self._rng = np.random.RandomState(self._seed)
+        self._start = time.time()
+
+    # Continue the signal from where it was paused
+    def resume(self):
+        self._start = time.time() - float(self._pos) / self.sample
+
+    def read(self):
+        t = (self._pos + self._index) / float(self.sample)
+        self._pos += self.chunk
+        timestamp = self._start + float(self._pos) / self.sample
+
+        if self._wave == "tone":
+            samples = np.sin(2 * np.pi * self._freq * t)
+        elif self._wave == "noise":
+            samples = self._rng.uniform(-1.0, 1.0, self.chunk)
+        else:
+            # Exponentially decaying tone burst at every beat
+            beat = np.mod(t, self._period)
+            samples = np.sin(2 * np.pi * self._freq * beat) * \
+                np.exp(-beat * 30.0)
+
+        if self._realtime:
+            delay = timestamp - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        return (pcm.encode(samples * self._amplitude, self.format,
+            self.channels), timestamp)
+
+    def pending(self):
+        if not self._realtime:
+            return 0
+        due = int((time.time() - self._start) * self.sample)
+        return max(0, (due - self._pos) // self.chunk)
+
+sources = {
+    "pyaudio" : PyAudioSource,
+    "pipe" : PipeSource,
+    "synth" : SynthSource,
+}
+
+# Parse a source spec into (backend class, options), raises
+# ValueError on unknown backends or invalid options.
+def parse(spec):
+    (name, _, args) = str(spec).partition(":")
+    if name not in sources:
+        raise ValueError("No such audio source: {0}".format(name))
+    cls = sources[name]
+
+    options = {}
+    for key in cls.options:
+        options[key] = cls.options[key].get("default")
+
+    for arg in filter(None, args.split(",")):
+        (key, sep, value) = arg.partition("=")
+        if key not in cls.options or not sep:
+            raise ValueError("Invalid option for {0}: {1}".format(name, arg))
+        option = cls.options[key]
+        try:
+            value = option["type"](value)
+        except ValueError:
+            raise ValueError("Wrong data type for option '{0}'".format(key))
+        if "values" in option and value not in option["values"]:
+            raise ValueError("Invalid value for '{0}': {1}".format(key, value))
+        if "min" in option and not value >= option["min"]:
+            raise ValueError("Value of '{0}' must be at least {1}"\
+                .format(key, option["min"]))
+        if "max" in option and not value <= option["max"]:
+            raise ValueError("Value of '{0}' must be at most {1}"\
+                .format(key, option["max"]))
+        options[key] = value
+
+    for key in cls.options:
+        if "default" not in cls.options[key] and options[key] == None:
+            raise ValueError("Option '{0}' is required for {1}"\
+                .format(key, name))
+    return (cls, options)
+
+def create(spec, sample, fmt, channels, chunk):
+    (cls, options) = parse(spec)
+    return cls(sample, fmt, channels, chunk, options)
@@ -0,0 +1,184 @@
+# Copyright (C) 2015 Fredrik Lindberg <fli@shapeshifter.se>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA
+
+import numpy as np
+
+# Split sample rate into bins with an exponential decay and
+# 0-156 selected as the smallest band.  Returns a list of
+# [start, end) offsets into the power array of a chunk sized FFT.
+def band_layout(sample, chunk):
+    bins = []
+    scale = 2
+    freq = sample / 2
+    while freq > 156:
+        prev_freq = freq
+        while True:
+            freq = freq / scale
+            # Pre-calculate offset into power array
+            prev_power_idx = scale * chunk * prev_freq / sample
+            power_idx = scale * chunk * freq / sample
+            if (prev_power_idx - power_idx) >= 1:
+                break
+        bins.insert(0, [int(power_idx), int(prev_power_idx)])
+
+    bins.insert(0, [0, int(scale * chunk * freq / sample)])
+    return bins
+
+# Split the power array of a size sized FFT into n logarithmically
+# spaced bands from fmin up to the Nyquist frequency, every band
+# covering at least one FFT bin.  Returns [start, end) offsets.
+def log_layout(sample, size, n, fmin=20.0):
+    power = size // 2 + 1
+    edges = np.geomspace(fmin, sample / 2.0, n + 1) * size / sample
+    edges = [max(1, int(edge)) for edge in edges]
+    for i in range(1, len(edges)):
+        edges[i] = max(edges[i], edges[i-1] + 1)
+    if edges[-1] > power:
+        raise ValueError("Too many bands ({0}) for FFT size {1}"\
+            .format(n, size))
+    return [[edges[i], edges[i+1]] for i in range(0, n)]
+
+# Pools a power spectrum into bands in one vectorized pass.
+#
+# The mean power of each band is computed from a cumulative sum
+# over the power array, sum(power[s:e]) = csum[e] - csum[s], which
+# handles any band layout, including empty bands and bands reaching
+# past the end of the power array.  The per-band 1/count and the EQ
+# weight are folded into a single weight vector so the whole
+# pool, EQ, scale and clip step runs in place on preallocated arrays.
+class BandPool(object):
+    def __init__(self, bins, size, eq=None):
+        self._size = size
+        start = np.array([min(s, size) for (s, _) in bins], dtype=np.intp)
+        end = np.array([min(e, size) for (_, e) in bins], dtype=np.intp)
+        count = np.maximum(end - start, 1)
+
+        if eq is None:
+            eq = np.ones(len(bins))
+        self._start = start
+        self._end = end
+        self._weight = np.asarray(eq, dtype=np.float64) / count
+
+        self._csum = np.zeros(size + 1)
+        self._lo = np.zeros(len(bins))
+        self.spectrum = np.zeros(len(bins))
+
+    def __len__(self):
+        return len(self.spectrum)
+
+    # Pool power into self.spectrum, apply weights, divide by
+    # scale and clip to [0.0, 1.0].  Returns self.spectrum.
+    def pool(self, power, scale=1.0):
+        csum = self._csum
+        spectrum = self.spectrum
+        np.cumsum(power[:self._size], out=csum[1:])
+        np.take(csum, self._end, out=spectrum)
+        np.take(csum, self._start, out=self._lo)
+        np.subtract(spectrum, self._lo, out=spectrum)
+        np.multiply(spectrum, self._weight, out=spectrum)
+        if scale != 1.0:
+            np.divide(spectrum, scale, out=spectrum)
+        np.clip(spectrum, 0.0, 1.0, out=spectrum)
+        return spectrum
+
+    # Pool a batch of power arrays, one per row, in one pass.
+    # Returns a new (rows, bands) array.
+    def pool_many(self, powers, scale=1.0):
+        csum = np.zeros((len(powers), self._size + 1))
+        np.cumsum(powers[:, :self._size], axis=1, out=csum[:, 1:])
+        spectrum = np.take(csum, self._end, axis=1)
+        spectrum -= np.take(csum, self._start, axis=1)
+        spectrum *= self._weight
+        if scale != 1.0:
+            spectrum /= scale
+        np.clip(spectrum, 0.0, 1.0, out=spectrum)
+        return spectrum
+
+# Short-time Fourier transform over a stream of samples.
+#
+# Samples are pushed hop samples at a time into a circular buffer of
+# size samples, every push produces the magnitude spectrum of the last
+# size samples.  The window is precomputed and normalized so that the
+# magnitudes are comparable to a plain FFT over one hop of samples,
+# which keeps the analyzer gain independent of the window size.
+class STFT(object):
+    windows = {
+        "rect" : np.ones,
+        "hann" : np.hanning,
+        "hamming" : np.hamming,
+        "blackman" : np.blackman,
+    }
+
+    def __init__(self, size, hop, window="rect"):
+        if window not in self.windows:
+            raise ValueError("No such window function: {0}".format(window))
+        if hop < 1 or hop > size:
+            raise ValueError("Invalid hop size {0} for window of {1}"\
+                .format(hop, size))
+        self.size = size
+        self.hop = hop
+
+        win = self.windows[window](size)
+        self._window = win * (float(hop) / win.sum())
+        self._buf = np.zeros(size)
+        self._frame = np.zeros(size)
+        self._pos = 0
+        self.power = np.zeros(size // 2 + 1)
+
+    def _write(self, samples):
+        size = self.size
+        pos = self._pos
+        n = min(len(samples), size - pos)
+        self._buf[pos:pos + n] = samples[:n]
+        if n < len(samples):
+            self._buf[:len(samples) - n] = samples[n:]
+        self._pos = (pos + len(samples)) % size
+
+    # Push hop samples, returns the magnitude spectrum of the window
+    def process(self, samples):
+        self._write(samples)
+
+        # Window the circular buffer in two parts, oldest sample first
+        size = self.size
+        pos = self._pos
+        np.multiply(self._buf[pos:], self._window[:size - pos],
+            out=self._frame[:size - pos])
+        np.multiply(self._buf[:pos], self._window[size - pos:],
+            out=self._frame[size - pos:])
+
+        np.abs(np.fft.rfft(self._frame), out=self.power)
+        return self.power
+
+    # Push several hops of samples at once, one row per hop, and
+    # return the magnitude spectra of all windows as a (rows, bins)
+    # array.  The windows are strided views over the history and the
+    # new samples, transformed with a single rfft.
+    def process_many(self, samples):
+        size = self.size
+        hop = self.hop
+        keep = size - hop
+        pos = self._pos
+
+        linear = np.empty(keep + samples.size)
+        history = np.concatenate((self._buf[pos:], self._buf[:pos]))
+        linear[:keep] = history[hop:]
+        linear[keep:] = samples.reshape(-1)
+        frames = np.lib.stride_tricks.sliding_window_view(linear, size)[::hop]
+
+        power = np.abs(np.fft.rfft(frames * self._window, axis=1))
+        self._buf[:] = linear[-size:]
+        self._pos = 0
+        self.power[:] = power[-1]
+        return power